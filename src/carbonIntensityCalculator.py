@@ -1,19 +1,17 @@
 import csv
+import io
+import json
 import math
+import os
 import sys
-from datetime import datetime as dt
-from datetime import timezone as tz
 
-import matplotlib.dates as mdates
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import pytz as pytz
-from numpy.lib.utils import source
-from sklearn.metrics import mean_squared_error
-from sklearn.preprocessing import MinMaxScaler
 
-import utility
+import carbonStore
+import forecastMetrics
+import instrumentation
 
 LOCAL_TIMEZONES = {"BPAT": "US/Pacific", "CISO": "US/Pacific", "ERCO": "US/Central", 
                     "SOCO" :"US/Central", "SWPP": "US/Central", "FPL": "US/Eastern", 
@@ -21,6 +19,14 @@ LOCAL_TIMEZONES = {"BPAT": "US/Pacific", "CISO": "US/Pacific", "ERCO": "US/Centr
                     "MISO": "US/Eastern"}
 
 CARBON_INTENSITY_COLUMN = 1 # column for real-time carbon intensity
+NUM_SOURCES = {"CISO": 8, "PJM": 8, "ERCO": 7, "ISNE": 8, "SE": 4, "DE": 10} # sources producing electricity
+CHUNK_SIZE = 8760 # rows per chunk in streaming mode (rounded up to whole days)
+TAIL_BLOCK_SIZE = 64 * 1024 # bytes read at a time when scanning a file backwards
+USE_CARBON_STORE = True # also write results to the carbon store (see carbonStore.py)
+# also write the carbon intensity under each emission factor scenario of EMISSION_SCENARIOS_FILE
+# (one column per scenario, see loadEmissionScenarios)
+USE_EMISSION_SCENARIOS = False
+EMISSION_SCENARIOS_FILE = "../data/emission_factor_scenarios.json"
 
 # Operational carbon emission factors
 # Carbon rate used by electricityMap. Checkout this link:
@@ -40,16 +46,23 @@ forcast_carbonRateDirect = {"avg_coal_production_forecast": 760, "avg_biomass_pr
 
 def initialize(inFileName):
     print("FILE: ", inFileName)
-    dataset = pd.read_csv(inFileName, header=0, infer_datetime_format=True, 
-                            parse_dates=["UTC time"]) #, index_col=["Local time"]
-    print(dataset.head(2))
-    print(dataset.tail(2))
+    # Always the csv (not the float32 columnar store), as the input columns are written
+    # back to the output file unchanged.
+    with instrumentation.span("load", file=os.path.basename(inFileName)):
+        dataset = pd.read_csv(inFileName, header=0, infer_datetime_format=True, 
+                                parse_dates=["UTC time"]) #, index_col=["Local time"]
+    instrumentation.log(dataset.head(2))
+    instrumentation.log(dataset.tail(2))
+    dataset = cleanDataset(dataset)
+    
+    instrumentation.log(dataset.columns)
+    # print("UTC time", dataset["UTC time"].dtype)
+    return dataset
+
+def cleanDataset(dataset):
     dataset.replace(np.nan, 0, inplace=True) # replace NaN with 0.0
     num = dataset._get_numeric_data()
     num[num<0] = 0
-    
-    print(dataset.columns)
-    # print("UTC time", dataset["UTC time"].dtype)
     return dataset
 
 def createHourlyTimeCol(dataset, datetime, startDate):
@@ -76,64 +89,153 @@ def createHourlyTimeCol(dataset, datetime, startDate):
     return hourlyDateTime
 
 
-def calculateCarbonIntensity(dataset, carbonRate, numSources):
-    global CARBON_INTENSITY_COLUMN
-    carbonIntensity = 0
-    carbonCol = []
-    miniDataset = dataset.iloc[:, CARBON_INTENSITY_COLUMN:CARBON_INTENSITY_COLUMN+numSources]
-    print("**", miniDataset.columns.values)
-    rowSum = miniDataset.sum(axis=1).to_list()
-    for i in range(len(miniDataset)):
-        if(rowSum[i] == 0):
-            # basic algorithm to fill missing values if all sources are missing
-            # just using the previous hour's value
-            # same as electricityMap
-            for j in range(1, len(dataset.columns.values)):
-                if(dataset.iloc[i, j] == 0):
-                    dataset.iloc[i, j] = dataset.iloc[i-1, j]
-                miniDataset.iloc[i] = dataset.iloc[i, CARBON_INTENSITY_COLUMN:CARBON_INTENSITY_COLUMN+numSources]
-                # print(miniDataset.iloc[i])
-            rowSum[i] = rowSum[i-1]
-        carbonIntensity = 0
-        for j in range(len(miniDataset.columns.values)):
-            source = miniDataset.columns.values[j]
-            sourceContribFrac = miniDataset.iloc[i, j]/rowSum[i]
-            # print(sourceContribFrac, carbonRate[source])
-            carbonIntensity += (sourceContribFrac * carbonRate[source])
-        if (carbonIntensity == 0):
-            print(miniDataset.iloc[i])
-        carbonCol.append(round(carbonIntensity, 2)) # rounding to 2 values after decimal place
-    dataset.insert(loc=CARBON_INTENSITY_COLUMN, column="carbon_intensity", value=carbonCol)
+def getEmissionFactorVector(sourceColumns, carbonRate):
+    # one emission factor (g/kWh) per source column, in column order
+    return np.array([carbonRate[source] for source in sourceColumns], dtype=np.float64)
+
+def getEmissionFactorMatrix(sourceColumns, carbonRates):
+    # sources x scenarios, one column per emission factor set
+    return np.stack([getEmissionFactorVector(sourceColumns, carbonRate) for carbonRate in carbonRates], axis=1)
+
+def getForecastCarbonRate(carbonRate):
+    # emission factors of the source forecast columns (as forcast_carbonRateDirect)
+    return {"avg_" + source + "_production_forecast": factor for source, factor in carbonRate.items()}
+
+def getScenarioCarbonRate(scenarios, name, iso, resolving=()):
+    scenario = scenarios[name]
+    if (name in resolving):
+        raise ValueError("Emission factor scenarios with a circular base: " + " -> ".join(resolving + (name,)))
+    base = scenario.get("base")
+    if (base is None):
+        carbonRate = dict(carbonRateDirect)
+    elif (base in scenarios):
+        carbonRate = getScenarioCarbonRate(scenarios, base, iso, resolving + (name,))
+    else:
+        raise ValueError("Unknown base: " + str(base) + " of emission factor scenario: " + name)
+    carbonRate.update(scenario.get("factors", {}))
+    carbonRate.update(scenario.get("regions", {}).get(iso, {}))
+    return carbonRate
+
+def loadEmissionScenarios(fileName=EMISSION_SCENARIOS_FILE, iso=None):
+    # Emission factor sets from a json file, {scenario name: {source: g/kWh}} in file order.
+    # Each scenario: {"base": <scenario>, "factors": {source: g/kWh}, "regions": {region: {source: g/kWh}},
+    #   "sweep": {"source": <source>, "values": [g/kWh, ...]}}, all optional.
+    # A scenario starts from the factors of its base (default: carbonRateDirect), then its own
+    # factors & those of the region (iso) override them. A sweep expands to one scenario
+    # per value, named <name>_<value>.
+    with open(fileName) as f:
+        scenarios = json.load(f)
+    carbonRates = {}
+    for name in scenarios:
+        carbonRate = getScenarioCarbonRate(scenarios, name, iso)
+        sweep = scenarios[name].get("sweep")
+        if (sweep is None):
+            carbonRates[name] = carbonRate
+            continue
+        for value in sweep["values"]:
+            carbonRates[name + "_" + str(value)] = dict(carbonRate, **{sweep["source"]: value})
+    return carbonRates
+
+def getEmissionScenarios(iso):
+    # scenarios written next to the direct carbon intensity, None if off
+    if (USE_EMISSION_SCENARIOS is False):
+        return None
+    scenarios = loadEmissionScenarios(EMISSION_SCENARIOS_FILE, iso)
+    print("Emission factor scenarios: ", list(scenarios.keys()))
+    return scenarios
+
+def getCarbonColumns(column, scenarios=None):
+    # the carbon intensity column & the column of each scenario (<column>_<scenario>)
+    return [column] + [column + "_" + name for name in (scenarios or {})]
+
+def fillMissingHours(values, sourceStart, numSources, previousRow=None):
+    # basic algorithm to fill missing values if all sources are missing
+    # just using the previous hour's value
+    # same as electricityMap
+    # Every zero entry of such an hour takes the previous hour's (already filled)
+    # value, so a run of missing hours carries the last hour with data forward.
+    # previousRow is the last filled row before values[0] (eg. from an earlier chunk).
+    sourceSum = values[:, sourceStart:sourceStart+numSources].sum(axis=1)
+    missingHours = (sourceSum == 0)
+    if (not missingHours.any()):
+        return values, missingHours
+    if (previousRow is not None):
+        values = np.vstack([np.asarray(previousRow, dtype=np.float64).reshape(1, -1), values])
+        missingHours = np.concatenate([[False], missingHours])
+    fillMask = missingHours[:, None] & (values == 0)
+    # masked forward fill: index of the last unmasked row, per column
+    rowIdx = np.where(fillMask, 0, np.arange(len(values))[:, None])
+    np.maximum.accumulate(rowIdx, axis=0, out=rowIdx)
+    values = np.take_along_axis(values, rowIdx, axis=0)
+    if (previousRow is not None):
+        values, missingHours = values[1:], missingHours[1:]
+    return values, missingHours
+
+def getCarbonIntensity(sourceValues, emissionFactors):
+    # weighted average of emission factors by each source's share of production
+    # emissionFactors: one per source (-> hours), or sources x scenarios (-> hours x scenarios,
+    # all scenarios in one matrix product)
+    rowSum = sourceValues.sum(axis=1)
+    if (emissionFactors.ndim == 2):
+        rowSum = rowSum[:, np.newaxis]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        carbonIntensity = (sourceValues @ emissionFactors) / rowSum
+    return np.round(carbonIntensity, 2) # rounding to 2 values after decimal place
+
+def computeCarbonIntensity(dataset, carbonRate, sourceStart, numSources, previousRow=None):
+    # Array-based engine shared by the real-time & forecast entry points.
+    # dataset column 0 is UTC time, sources are dataset columns sourceStart onwards.
+    # Missing hours are filled in place (as before); returns the intensity column.
+    # carbonRate may also be a list of emission factor sets, one intensity column each.
+    sourceColumns = dataset.columns.values[sourceStart:sourceStart+numSources]
+    instrumentation.log("**", sourceColumns)
+    if (isinstance(carbonRate, dict)):
+        emissionFactors = getEmissionFactorVector(sourceColumns, carbonRate)
+    else:
+        emissionFactors = getEmissionFactorMatrix(sourceColumns, carbonRate)
+    values = dataset.iloc[:, 1:].to_numpy(dtype=np.float64)
+    with instrumentation.span("fill"):
+        values, missingHours = fillMissingHours(values, sourceStart-1, numSources, previousRow)
+        if (missingHours.any()):
+            for j in np.flatnonzero((values[missingHours] != 
+                    dataset.iloc[missingHours, 1:].to_numpy(dtype=np.float64)).any(axis=0)):
+                col = dataset.columns.values[j+1]
+                dataset[col] = values[:, j].astype(dataset[col].dtype)
+    with instrumentation.span("calculate"):
+        carbonCol = getCarbonIntensity(values[:, sourceStart-1:sourceStart-1+numSources], 
+                        emissionFactors)
+    if (instrumentation.QUIET is False):
+        for i in np.flatnonzero((carbonCol if carbonCol.ndim == 1 else carbonCol[:, 0]) == 0):
+            print(dataset.iloc[i, sourceStart:sourceStart+numSources])
+    return carbonCol
+
+def insertCarbonColumns(dataset, loc, column, carbonCol, scenarios=None):
+    # the intensity column, followed by the column of each scenario
+    if (scenarios is None):
+        dataset.insert(loc=loc, column=column, value=carbonCol)
+        return dataset
+    for i, col in enumerate(getCarbonColumns(column, scenarios)):
+        dataset.insert(loc=loc+i, column=col, value=carbonCol[:, i])
     return dataset
 
-def calculateCarbonIntensityFromSourceForecasts(dataset, carbonRate, numSources):
+def calculateCarbonIntensity(dataset, carbonRate, numSources, previousRow=None, scenarios=None):
+    # scenarios: {name: {source: g/kWh}} (see loadEmissionScenarios), computed in the same pass
     global CARBON_INTENSITY_COLUMN
-    carbonCol = []
-    miniDataset = dataset.iloc[:, CARBON_INTENSITY_COLUMN+1:CARBON_INTENSITY_COLUMN+1+numSources]
-    print("**", miniDataset.columns.values)
-    rowSum = miniDataset.sum(axis=1).to_list()
-    for i in range(len(miniDataset)):
-        if(rowSum[i] == 0):
-            # basic algorithm to fill missing values if all sources are missing
-            # just using the previous hour's value
-            # same as electricityMap
-            for j in range(1, len(dataset.columns.values)):
-                if(dataset.iloc[i, j] == 0):
-                    dataset.iloc[i, j] = dataset.iloc[i-1, j]
-                miniDataset.iloc[i] = dataset.iloc[i, CARBON_INTENSITY_COLUMN+1:CARBON_INTENSITY_COLUMN+1+numSources]
-                # print(miniDataset.iloc[i])
-            rowSum[i] = rowSum[i-1]
-        carbonIntensity = 0
-        for j in range(len(miniDataset.columns.values)):
-            source = miniDataset.columns.values[j]
-            sourceContribFrac = miniDataset.iloc[i, j]/rowSum[i]
-            # print(sourceContribFrac, carbonRate[source])
-            carbonIntensity += (sourceContribFrac * carbonRate[source])
-        if (carbonIntensity == 0):
-            print(miniDataset.iloc[i])
-        carbonCol.append(round(carbonIntensity, 2)) # rounding to 2 values after decimal place
-    dataset.insert(loc=CARBON_INTENSITY_COLUMN+1, column="carbon_from_src_forecasts", value=carbonCol)
-    return dataset
+    if (scenarios is not None):
+        carbonRate = [carbonRate] + list(scenarios.values())
+    carbonCol = computeCarbonIntensity(dataset, carbonRate, CARBON_INTENSITY_COLUMN, numSources, 
+                    previousRow)
+    return insertCarbonColumns(dataset, CARBON_INTENSITY_COLUMN, "carbon_intensity", carbonCol, scenarios)
+
+def calculateCarbonIntensityFromSourceForecasts(dataset, carbonRate, numSources, previousRow=None,
+                                                    scenarios=None):
+    global CARBON_INTENSITY_COLUMN
+    if (scenarios is not None):
+        carbonRate = [carbonRate] + [getForecastCarbonRate(rate) for rate in scenarios.values()]
+    carbonCol = computeCarbonIntensity(dataset, carbonRate, CARBON_INTENSITY_COLUMN+1, numSources, 
+                    previousRow)
+    return insertCarbonColumns(dataset, CARBON_INTENSITY_COLUMN+1, "carbon_from_src_forecasts", carbonCol,
+                scenarios)
 
 
 def getDatesInLocalTimeZone(dateTime, localTimezone):
@@ -145,45 +247,193 @@ def getDatesInLocalTimeZone(dateTime, localTimezone):
         dates.append(day)    
     return dates
 
-def runProgram(iso, isForecast, numSources):
-    IN_FILE_NAME = None
-    OUT_FILE_NAME = None
-
+def getFileNames(iso, isForecast):
     if (isForecast is True):
         IN_FILE_NAME = "../data/"+iso+"/"+iso+"_src_prod_forecasts_test_period.csv"
         OUT_FILE_NAME = "../data/"+iso+"/"+iso+"_carbon_from_src_prod_forecasts_direct.csv"
     else:
         IN_FILE_NAME = "../data/"+iso+"/"+iso+".csv"
         OUT_FILE_NAME = "../data/"+iso+"/"+iso+"_direct_emissions.csv"        
+    return IN_FILE_NAME, OUT_FILE_NAME
+
+def printMapeSummary(dailyMape, avgMape):
+    print("Mean MAPE: ", avgMape)
+    print("Median MAPE: ", np.percentile(dailyMape, 50))
+    print("90th percentile MAPE: ", np.percentile(dailyMape, 90))
+    print("95th percentile MAPE: ", np.percentile(dailyMape, 95))
+    return
+
+def runProgram(iso, isForecast, numSources):
+    IN_FILE_NAME, OUT_FILE_NAME = getFileNames(iso, isForecast)
     
     dataset = initialize(IN_FILE_NAME)
+    scenarios = getEmissionScenarios(iso)
 
     if (isForecast is True):
         print("Calculating carbon intensity from src prod forecasts using direct emission factors...")
         dataset = calculateCarbonIntensityFromSourceForecasts(dataset, forcast_carbonRateDirect, 
-                    numSources)
-
-        dailyAvgMape, avgMape = utility.getMape(dataset["UTC time"].values, dataset["carbon_intensity"].values, 
-                        dataset["carbon_from_src_forecasts"].values)
-        print("Mean MAPE: ", avgMape)
-        print("Median MAPE: ", np.percentile(dailyAvgMape, 50))
-        print("90th percentile MAPE: ", np.percentile(dailyAvgMape, 90))
-        print("95th percentile MAPE: ", np.percentile(dailyAvgMape, 95))
+                    numSources, scenarios=scenarios)
+
+        with instrumentation.span("evaluate"):
+            dailyAvgMape, avgMape = forecastMetrics.getDailyMape(dataset["UTC time"].values, 
+                            dataset["carbon_intensity"].values, dataset["carbon_from_src_forecasts"].values)
+            hourlyErrors = forecastMetrics.getHourOfDayErrors(dataset["UTC time"].values, 
+                            dataset["carbon_intensity"].values, dataset["carbon_from_src_forecasts"].values)
+        printMapeSummary(dailyAvgMape, avgMape)
+        print("Errors by hour of day (UTC):")
+        forecastMetrics.printHourOfDayErrors(hourlyErrors)
     else:
         print("Calculating real time carbon intensity using direct emission factors...")
-        dataset = calculateCarbonIntensity(dataset, carbonRateDirect, numSources)
+        dataset = calculateCarbonIntensity(dataset, carbonRateDirect, numSources, scenarios=scenarios)
 
-    dataset.to_csv(OUT_FILE_NAME)
+    with instrumentation.span("write", file=os.path.basename(OUT_FILE_NAME)):
+        dataset.to_csv(OUT_FILE_NAME)
+    updateCarbonStore(iso, isForecast, dataset)
     
     return
 
+def updateCarbonStore(iso, isForecast, dataset, store=None):
+    # hourly carbon intensity for time-range queries
+    if (USE_CARBON_STORE is False or iso is None):
+        return
+    if (store is None):
+        store = carbonStore.CarbonStore()
+    kind = "forecast" if (isForecast is True) else "realtime"
+    with instrumentation.span("write", file="carbon store"):
+        store.update(iso, kind, dataset["UTC time"], dataset[carbonStore.KINDS[kind]].values)
+    return
+
+def processChunks(reader, outFileName, isForecast, numSources, previousRow=None, 
+                    writeHeader=True, iso=None, scenarios=None):
+    # Computes carbon intensity chunk by chunk & appends each chunk to the output file.
+    # The last (filled) row of a chunk seeds the missing-hour fill of the next one,
+    # so only one chunk is held in memory at a time.
+    # Returns no. of rows written & the daily MAPEs (forecast mode only).
+    # If iso is given, the results also go to the carbon store.
+    numRows = 0
+    store = carbonStore.CarbonStore()
+    dailyMape, hourlyErrorSum = [], 0
+    for chunk in instrumentation.iterSpans("load", reader):
+        chunk = cleanDataset(chunk)
+        if (isForecast is True):
+            chunk = calculateCarbonIntensityFromSourceForecasts(chunk, forcast_carbonRateDirect, 
+                        numSources, previousRow, scenarios)
+            previousRow = chunk.drop(columns=getCarbonColumns("carbon_from_src_forecasts", scenarios)).iloc[-1, 1:]
+            with instrumentation.span("evaluate"):
+                chunkDailyMape, chunkMape = forecastMetrics.getDailyMape(chunk["UTC time"].values, 
+                            chunk["carbon_intensity"].values, chunk["carbon_from_src_forecasts"].values)
+            dailyMape.extend(chunkDailyMape)
+            hourlyErrorSum += chunkMape * len(chunk)
+        else:
+            chunk = calculateCarbonIntensity(chunk, carbonRateDirect, numSources, previousRow, scenarios)
+            previousRow = chunk.drop(columns=getCarbonColumns("carbon_intensity", scenarios)).iloc[-1, 1:]
+        previousRow = previousRow.to_numpy(dtype=np.float64)
+        with instrumentation.span("write", file=os.path.basename(outFileName)):
+            chunk.to_csv(outFileName, mode="w" if writeHeader else "a", header=writeHeader)
+        updateCarbonStore(iso, isForecast, chunk, store)
+        writeHeader = False
+        numRows += len(chunk)
+        print("Rows processed: ", numRows)
+    avgMape = (hourlyErrorSum / numRows) if (isForecast is True and numRows > 0) else None
+    return numRows, dailyMape, avgMape
+
+def iterLinesReversed(fileObj, dataStart):
+    # yields the non-empty lines of a (binary) file from the end back to dataStart
+    fileObj.seek(0, os.SEEK_END)
+    pos = fileObj.tell()
+    leftover = b""
+    while pos > dataStart:
+        step = min(TAIL_BLOCK_SIZE, pos - dataStart)
+        pos -= step
+        fileObj.seek(pos)
+        lines = (fileObj.read(step) + leftover).split(b"\n")
+        # first piece may be a partial line, unless we reached the start of the data
+        leftover = lines.pop(0) if pos > dataStart else b""
+        for line in reversed(lines):
+            if (line.strip()):
+                yield line
+    if (leftover.strip()):
+        yield leftover
+
+def readCsvTail(fileName, isWanted, timeCol="UTC time"):
+    # Parses only the trailing rows of a csv file: rows are read backwards
+    # until isWanted(<row time>) is False.
+    with open(fileName, "rb") as f:
+        header = f.readline()
+        timeIdx = next(csv.reader([header.decode()])).index(timeCol)
+        lines = []
+        for line in iterLinesReversed(f, len(header)):
+            rowTime = pd.Timestamp(next(csv.reader([line.decode()]))[timeIdx])
+            if (not isWanted(rowTime)):
+                break
+            lines.append(line)
+    lines.reverse()
+    return pd.read_csv(io.BytesIO(header + b"\n".join(lines)), header=0, 
+                        parse_dates=[timeCol])
+
+def readLastRow(fileName):
+    # last row of a file written by runProgram (index in column 0)
+    with open(fileName, "rb") as f:
+        header = f.readline()
+        lastLine = next(iterLinesReversed(f, len(header)))
+    tail = pd.read_csv(io.BytesIO(header + lastLine), header=0, index_col=0, 
+                        parse_dates=["UTC time"])
+    return tail.iloc[-1]
+
+def runProgramIncremental(iso, isForecast, numSources):
+    IN_FILE_NAME, OUT_FILE_NAME = getFileNames(iso, isForecast)
+    if (not os.path.exists(OUT_FILE_NAME)):
+        print(OUT_FILE_NAME, " not found, processing the whole input file...")
+        return runProgramStreaming(iso, isForecast, numSources)
+    carbonCol = "carbon_from_src_forecasts" if (isForecast is True) else "carbon_intensity"
+    lastRow = readLastRow(OUT_FILE_NAME)
+    lastTime = lastRow["UTC time"]
+    print("Last processed hour in ", OUT_FILE_NAME, ": ", lastTime)
+
+    newRows = readCsvTail(IN_FILE_NAME, lambda rowTime: rowTime > lastTime)
+    if (len(newRows) == 0):
+        print("No new rows in ", IN_FILE_NAME)
+        return
+    scenarios = getEmissionScenarios(iso)
+    carbonColumns = getCarbonColumns(carbonCol, scenarios)
+    if (any(col not in lastRow.index for col in carbonColumns)):
+        raise ValueError("Carbon intensity columns of " + OUT_FILE_NAME + 
+                            " do not match the emission factor scenarios")
+    previousRow = lastRow.drop(labels=carbonColumns)
+    if (list(previousRow.index) != list(newRows.columns)):
+        raise ValueError("Columns of " + IN_FILE_NAME + " do not match " + OUT_FILE_NAME)
+    print("New rows: ", len(newRows), " (", newRows["UTC time"].iloc[0], " - ", 
+            newRows["UTC time"].iloc[-1], ")")
+    newRows.index = pd.RangeIndex(lastRow.name+1, lastRow.name+1+len(newRows))
+    # carry forward from the stored last row, then append
+    previousRow = previousRow.iloc[1:].to_numpy(dtype=np.float64)
+    numRows, dailyMape, avgMape = processChunks([newRows], OUT_FILE_NAME, isForecast, 
+                                    numSources, previousRow, writeHeader=False, iso=iso, scenarios=scenarios)
+    if (isForecast is True):
+        print("Mean MAPE (new rows): ", avgMape)
+    return
+
+def runProgramStreaming(iso, isForecast, numSources, chunkSize=CHUNK_SIZE):
+    IN_FILE_NAME, OUT_FILE_NAME = getFileNames(iso, isForecast)
+    print("FILE: ", IN_FILE_NAME, ", streaming in chunks of ", chunkSize, " rows")
+    # whole days per chunk, so that daily MAPEs do not straddle chunk boundaries
+    chunkSize = int(math.ceil(chunkSize / 24) * 24)
+    reader = pd.read_csv(IN_FILE_NAME, header=0, parse_dates=["UTC time"], chunksize=chunkSize)
+    numRows, dailyMape, avgMape = processChunks(reader, OUT_FILE_NAME, isForecast, numSources, iso=iso,
+                                    scenarios=getEmissionScenarios(iso))
+    if (isForecast is True and numRows > 0):
+        printMapeSummary(dailyMape, avgMape)
+    return
+
 
 if __name__ == "__main__":
-    if (len(sys.argv) !=4):
-        print("Usage: python3 carbonIntensityCalculator.py <region> <f/r> <num_sources>")
+    if (len(sys.argv) < 4 or len(sys.argv) > 6):
+        print("Usage: python3 carbonIntensityCalculator.py <region> <f/r> <num_sources> [<mode> [chunk_rows]]")
         print("Refer github repo for regions.")
         print("f - forecast, r - real time")
         print("num_sources - no. of sources producing electricity in the region")
+        print("mode - full (default, whole file in memory), stream (fixed-size chunks),")
+        print("       incr (append only the rows newer than the last hour in the output file)")
         # print("carbon_intensity_col - column no. where carbon_intensity should be inserted")
         exit(0)
     print("DACF: Calculating carbon intensity for region: ", sys.argv[1])
@@ -192,7 +442,15 @@ if __name__ == "__main__":
     if (sys.argv[2].lower() == "f"):
         isForecast = True
     numSources = int(sys.argv[3])
-    runProgram(region, isForecast, numSources)
+    mode = sys.argv[4].lower() if len(sys.argv) > 4 else "full"
+    with instrumentation.span("carbon intensity", region=region, forecast=isForecast, mode=mode):
+        if (mode == "stream"):
+            chunkSize = int(sys.argv[5]) if len(sys.argv) > 5 else CHUNK_SIZE
+            runProgramStreaming(region, isForecast, numSources, chunkSize)
+        elif (mode == "incr"):
+            runProgramIncremental(region, isForecast, numSources)
+        else:
+            runProgram(region, isForecast, numSources)
     print("Calculating carbon intensity for region: ", sys.argv[1], " done.")
 
 
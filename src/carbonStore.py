@@ -0,0 +1,227 @@
+import contextlib
+import fcntl
+import json
+import os
+import sys
+import threading
+import uuid
+
+import numpy as np
+import pandas as pd
+
+############################# MACRO START #######################################
+STORE_DIR = "../data/carbon_store/"
+REGIONS = ["CISO", "PJM", "ERCO", "ISNE", "SE", "DE"]
+KINDS = {"realtime": "carbon_intensity", "forecast": "carbon_from_src_forecasts"} # kind: column
+HOUR_NS = 3600 * 10**9
+DTYPE = np.dtype("<f8")
+############################# MACRO END #########################################
+
+# Hourly real-time & forecast carbon intensity of each region, for time-range queries.
+# <root>/<region>/<kind>.json holds the UTC hour (since epoch) of the first value, the
+# no. of hours & the name of the data file: raw float64 values, one per hour (NaN: no data).
+# A query is an offset computation plus a slice of the memory-mapped array, so it does
+# not depend on the length of the series & does not copy the values.
+# Updates write into the data file in place & append to it when they extend the series,
+# so their cost depends only on the no. of hours written (only hours before the first
+# stored hour need a new data file). The json is replaced after the data is written, so
+# readers never see hours that are not written yet. Updates of a series are serialized
+# by a lock file (<kind>.lock).
+
+def toHours(times):
+    # UTC hours since epoch; tz-naive times are taken as UTC
+    dates = pd.DatetimeIndex(pd.to_datetime(times, utc=True))
+    ns = dates.asi8
+    if (np.any(ns % HOUR_NS != 0)):
+        raise ValueError("Times must be on the hour")
+    return ns // HOUR_NS
+
+def toHour(time):
+    # toHours of a single time (Timestamp.value is UTC for tz-aware times)
+    ns = pd.Timestamp(time).value
+    if (ns % HOUR_NS != 0):
+        raise ValueError("Times must be on the hour")
+    return ns // HOUR_NS
+
+def toTimestamp(hour):
+    return pd.Timestamp(int(hour) * HOUR_NS, tz="UTC")
+
+class CarbonStore:
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        self.series = {} # (region, kind): ((meta file inode, mtime), start hour, memory-mapped values)
+        self.lock = threading.Lock()
+
+    def getMetaFileName(self, region, kind):
+        if (kind not in KINDS):
+            raise ValueError("Unknown kind: " + str(kind) + ", use one of " + str(list(KINDS.keys())))
+        return os.path.join(self.root, region, kind + ".json")
+
+    def getSeries(self, region, kind):
+        # (start hour, values) of a region's series, re-mapped only if it was updated
+        metaFileName = self.getMetaFileName(region, kind)
+        # the json is replaced (new inode) on every update
+        try:
+            fileStat = os.stat(metaFileName)
+        except FileNotFoundError:
+            raise KeyError("No " + kind + " carbon intensity for region: " + region)
+        version = (fileStat.st_ino, fileStat.st_mtime_ns)
+        with self.lock:
+            cached = self.series.get((region, kind))
+            if (cached is not None and cached[0] == version):
+                return cached[1], cached[2]
+        with open(metaFileName) as f:
+            meta = json.load(f)
+        values = self.mapValues(os.path.join(self.root, region, meta["dataFile"]), meta["numHours"])
+        with self.lock:
+            self.series[(region, kind)] = (version, meta["startHour"], values)
+        return meta["startHour"], values
+
+    # Values of the hours in [start, end), clipped to the stored hours.
+    # Returns (time of the first returned hour or None, read-only view of the values).
+    def getRange(self, region, kind, start, end):
+        startHour, values = self.getSeries(region, kind)
+        first = max(toHour(start) - startHour, 0)
+        last = min(toHour(end) - startHour, len(values))
+        if (last <= first):
+            return None, values[0:0]
+        return toTimestamp(startHour + first), values[first:last]
+
+    def getFrame(self, region, start, end):
+        # real-time & forecast carbon intensity of [start, end) as a frame indexed by UTC time
+        dates = pd.date_range(pd.Timestamp(start), pd.Timestamp(end), freq="H", inclusive="left")
+        if (dates.tz is None):
+            dates = dates.tz_localize("UTC")
+        frame = pd.DataFrame(index=dates.rename("UTC time"))
+        for kind, col in KINDS.items():
+            frame[col] = np.nan
+            try:
+                firstTime, values = self.getRange(region, kind, start, end)
+            except KeyError:
+                continue
+            if (firstTime is not None):
+                offset = dates.get_loc(firstTime)
+                frame.iloc[offset:offset+len(values), frame.columns.get_loc(col)] = values
+        return frame
+
+    def getCoverage(self, region, kind):
+        # (first hour, last hour) stored for a region, or None
+        try:
+            startHour, values = self.getSeries(region, kind)
+        except KeyError:
+            return None
+        return toTimestamp(startHour), toTimestamp(startHour + len(values) - 1)
+
+    def mapValues(self, dataFileName, numHours, mode="r"):
+        if (dataFileName.endswith(".npy")): # stores written before the raw format
+            return np.load(dataFileName, mmap_mode=mode)
+        if (numHours == 0):
+            return np.empty(0, dtype=DTYPE)
+        return np.memmap(dataFileName, dtype=DTYPE, mode=mode, shape=(numHours,))
+
+    @contextlib.contextmanager
+    def lockSeries(self, region, kind):
+        # exclusive lock of a series (across processes) for the read-modify-write of an update
+        regionDir = os.path.join(self.root, region)
+        os.makedirs(regionDir, exist_ok=True)
+        with open(os.path.join(regionDir, kind + ".lock"), "a") as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+    def writeMeta(self, metaFileName, meta):
+        tmpFileName = metaFileName + ".tmp" + uuid.uuid4().hex
+        with open(tmpFileName, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmpFileName, metaFileName)
+        return
+
+    def update(self, region, kind, times, values):
+        # Writes hourly values into a region's series (extending it as needed); hours that
+        # are already stored are overwritten.
+        metaFileName = self.getMetaFileName(region, kind)
+        hours = toHours(times)
+        if (len(hours) == 0):
+            return
+        values = np.asarray(values, dtype=DTYPE)
+        regionDir = os.path.join(self.root, region)
+        with self.lockSeries(region, kind):
+            meta = None
+            if (os.path.exists(metaFileName)):
+                with open(metaFileName) as f:
+                    meta = json.load(f)
+            newStart, newEnd = int(hours.min()), int(hours.max())+1
+            if (meta is not None and newStart >= meta["startHour"] and not meta["dataFile"].endswith(".npy")):
+                # in place: NaN for the gap after the stored hours, then the values
+                dataFileName = os.path.join(regionDir, meta["dataFile"])
+                newStart, oldEnd = meta["startHour"], meta["startHour"] + meta["numHours"]
+                newEnd = max(newEnd, oldEnd)
+                with open(dataFileName, "r+b") as f:
+                    f.seek(meta["numHours"] * DTYPE.itemsize)
+                    f.truncate()
+                    np.full(newEnd - oldEnd, np.nan, dtype=DTYPE).tofile(f)
+                data = self.mapValues(dataFileName, newEnd - newStart, "r+")
+                data[hours - newStart] = values
+                data.flush()
+                del data
+                dataFile, oldDataFile = meta["dataFile"], None
+            else:
+                # new data file: first update, hours before the first stored hour, or an old .npy store
+                oldStart, oldValues = newStart, np.empty(0)
+                if (meta is not None):
+                    oldStart = meta["startHour"]
+                    oldValues = self.mapValues(os.path.join(regionDir, meta["dataFile"]), meta["numHours"])
+                newStart = min(newStart, oldStart)
+                newEnd = max(newEnd, oldStart+len(oldValues))
+                data = np.full(newEnd - newStart, np.nan, dtype=DTYPE)
+                data[oldStart-newStart:oldStart-newStart+len(oldValues)] = oldValues
+                data[hours - newStart] = values
+                dataFile = kind + "_" + uuid.uuid4().hex + ".bin"
+                data.tofile(os.path.join(regionDir, dataFile))
+                oldDataFile = None if meta is None else meta["dataFile"]
+            self.writeMeta(metaFileName, {"startHour": newStart, "numHours": newEnd - newStart, "dataFile": dataFile})
+            if (oldDataFile is not None):
+                try:
+                    os.remove(os.path.join(regionDir, oldDataFile))
+                except FileNotFoundError:
+                    pass
+        print("Carbon store: ", region, kind, ", ", len(hours), " hours written (",
+                toTimestamp(newStart), " - ", toTimestamp(newEnd-1), ")")
+        return
+
+    def importOutputFile(self, region, kind, fileName):
+        # loads an output file of carbonIntensityCalculator
+        dataset = pd.read_csv(fileName, header=0, usecols=["UTC time", KINDS[kind]])
+        self.update(region, kind, dataset["UTC time"], dataset[KINDS[kind]].values)
+        return
+
+
+if __name__ == "__main__":
+    if (len(sys.argv) < 3 or sys.argv[1] not in ["import", "query"] or
+            (sys.argv[1] == "query" and len(sys.argv) != 6)):
+        print("Usage: python3 carbonStore.py import <regions>")
+        print("       python3 carbonStore.py query <region> <r/f> <start> <end>")
+        print("import - loads the outputs of carbonIntensityCalculator.py (regions: comma separated list, or all)")
+        print("query - hourly carbon intensity of [start, end), times in UTC")
+        print("Example: python3 carbonStore.py query CISO r \"2020-01-01 00:00\" \"2020-01-02 00:00\"")
+        exit(0)
+    store = CarbonStore()
+    if (sys.argv[1] == "import"):
+        regions = REGIONS if sys.argv[2].lower() == "all" else sys.argv[2].split(",")
+        for region in regions:
+            for kind, fileName in [("realtime", "../data/"+region+"/"+region+"_direct_emissions.csv"),
+                    ("forecast", "../data/"+region+"/"+region+"_carbon_from_src_prod_forecasts_direct.csv")]:
+                if (os.path.exists(fileName)):
+                    store.importOutputFile(region, kind, fileName)
+                else:
+                    print(fileName, " not found, skipping")
+    else:
+        kind = "forecast" if sys.argv[3].lower() == "f" else "realtime"
+        firstTime, values = store.getRange(sys.argv[2], kind, sys.argv[4], sys.argv[5])
+        if (firstTime is None):
+            print("No data in the given range")
+            exit(0)
+        for date, value in zip(pd.date_range(firstTime, periods=len(values), freq="H"), values):
+            print(date, value)
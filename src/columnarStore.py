@@ -0,0 +1,154 @@
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+############################# MACRO START #######################################
+DATA_DIR = "../data/"
+REGIONS = ["CISO", "PJM", "ERCO", "ISNE", "SE", "DE"]
+STORE_DIR_SUFFIX = ".cols"
+STORE_VERSION = 1
+TIME_COL = "UTC time"
+DROP_COLUMNS = ["Unnamed: 0", "Local time"] # csv index & local time (derivable from UTC time)
+META_FILE = "meta.json"
+TIME_FILE = "time.npy"
+############################# MACRO END #########################################
+
+# Columnar copy of a data file: <file>.cols/ next to <file>.csv, with one .npy file per
+# column (float32 for numeric columns) & the UTC time as datetime64. Columns are
+# memory-mapped when read, so only the pages that are used get loaded. The csv stays the
+# source of truth: the store records its mtime & size and is only used while they match.
+# Note that float32 keeps ~7 significant digits.
+
+def getStoreDir(csvFileName):
+    return os.path.splitext(csvFileName)[0] + STORE_DIR_SUFFIX
+
+def readMeta(storeDir):
+    metaFileName = os.path.join(storeDir, META_FILE)
+    if (not os.path.exists(metaFileName)):
+        return None
+    with open(metaFileName) as f:
+        return json.load(f)
+
+def isStoreUpToDate(csvFileName):
+    # True if the store exists & was converted from the current csv (or the csv is gone)
+    meta = readMeta(getStoreDir(csvFileName))
+    if (meta is None or meta["version"] != STORE_VERSION):
+        return False
+    if (not os.path.exists(csvFileName)):
+        return True
+    fileStat = os.stat(csvFileName)
+    return meta["sourceMtimeNs"] == fileStat.st_mtime_ns and meta["sourceSize"] == fileStat.st_size
+
+def convertCsv(csvFileName):
+    dataset = pd.read_csv(csvFileName, header=0)
+    if (TIME_COL not in dataset.columns):
+        raise ValueError(csvFileName + " has no " + TIME_COL + " column")
+    dates = pd.to_datetime(dataset[TIME_COL])
+    timeZone = None
+    if (dates.dt.tz is not None):
+        timeZone = str(dates.dt.tz)
+        dates = dates.dt.tz_convert("UTC").dt.tz_localize(None)
+    fileStat = os.stat(csvFileName)
+    storeDir = getStoreDir(csvFileName)
+    tmpDir = storeDir + ".tmp_" + uuid.uuid4().hex
+    os.makedirs(tmpDir)
+    meta = {"version": STORE_VERSION, "sourceFile": os.path.basename(csvFileName),
+            "sourceMtimeNs": fileStat.st_mtime_ns, "sourceSize": fileStat.st_size,
+            "numRows": len(dataset), "timeZone": timeZone, "columns": [], "files": []}
+    try:
+        np.save(os.path.join(tmpDir, TIME_FILE), dates.values.astype("datetime64[ns]"))
+        columns = [col for col in dataset.columns if col != TIME_COL and col not in DROP_COLUMNS]
+        for i in range(len(columns)):
+            values = dataset[columns[i]]
+            if (pd.api.types.is_numeric_dtype(values)):
+                values = values.to_numpy(dtype=np.float32)
+            else:
+                values = values.astype(str).to_numpy(dtype=str)
+            fileName = "c" + str(i) + ".npy"
+            np.save(os.path.join(tmpDir, fileName), values)
+            meta["columns"].append(columns[i])
+            meta["files"].append(fileName)
+        with open(os.path.join(tmpDir, META_FILE), "w") as f:
+            json.dump(meta, f, indent=2)
+        if (os.path.exists(storeDir)):
+            oldDir = storeDir + ".old_" + uuid.uuid4().hex
+            os.rename(storeDir, oldDir)
+            os.rename(tmpDir, storeDir)
+            shutil.rmtree(oldDir, ignore_errors=True)
+        else:
+            os.rename(tmpDir, storeDir)
+    except BaseException:
+        shutil.rmtree(tmpDir, ignore_errors=True)
+        raise
+    return storeDir
+
+# Returns the frame indexed by UTC time (named TIME_COL, tz-aware if the csv times were),
+# or with UTC time as the first column if timeIndex is False.
+# mmap: columns are copy-on-write memory maps, so in-place changes stay private.
+def readStore(storeDir, columns=None, mmap=True, timeIndex=True):
+    meta = readMeta(storeDir)
+    if (meta is None):
+        raise FileNotFoundError("No columnar store at " + storeDir)
+    dates = pd.DatetimeIndex(np.load(os.path.join(storeDir, TIME_FILE)), name=TIME_COL)
+    if (meta["timeZone"] is not None):
+        dates = dates.tz_localize("UTC").tz_convert(meta["timeZone"])
+    fileNames = dict(zip(meta["columns"], meta["files"]))
+    if (columns is None):
+        columns = meta["columns"]
+    mmapMode = "c" if mmap is True else None
+    data = {col: np.load(os.path.join(storeDir, fileNames[col]), mmap_mode=mmapMode) for col in columns}
+    if (timeIndex is True):
+        return pd.DataFrame(data, index=dates, copy=False)
+    dataset = pd.DataFrame(data, copy=False)
+    dataset.insert(0, TIME_COL, dates)
+    return dataset
+
+def getDataFiles(region):
+    regionDir = DATA_DIR + region + "/"
+    fileNames = []
+    for dirName in [regionDir, regionDir + "fuel_forecast/"]:
+        if (os.path.isdir(dirName)):
+            fileNames.extend([dirName + fileName for fileName in sorted(os.listdir(dirName))
+                                if fileName.endswith(".csv")])
+    return fileNames
+
+def convertRegion(region):
+    for csvFileName in getDataFiles(region):
+        if (isStoreUpToDate(csvFileName)):
+            print(csvFileName, ": up to date")
+            continue
+        startTime = time.time()
+        try:
+            storeDir = convertCsv(csvFileName)
+        except ValueError as e:
+            print(csvFileName, ": skipped, ", e)
+            continue
+        convertTime = time.time() - startTime
+        storeSize = sum(os.path.getsize(os.path.join(storeDir, fileName)) for fileName in os.listdir(storeDir))
+        startTime = time.time()
+        pd.read_csv(csvFileName, header=0, parse_dates=[TIME_COL])
+        csvReadTime = time.time() - startTime
+        startTime = time.time()
+        readStore(storeDir)
+        storeReadTime = time.time() - startTime
+        print(csvFileName, ": ", round(os.path.getsize(csvFileName) / 1e6, 2), "MB -> ",
+                round(storeSize / 1e6, 2), "MB in ", round(convertTime, 2), "s, read: ",
+                round(csvReadTime * 1000, 1), "ms (csv), ", round(storeReadTime * 1000, 1), "ms (store)")
+    return
+
+
+if __name__ == "__main__":
+    if (len(sys.argv) != 2):
+        print("Usage: python3 columnarStore.py <regions>")
+        print("regions - comma separated list, or all")
+        print("Converts the csv files of data/<region>/ & data/<region>/fuel_forecast/")
+        exit(0)
+    regions = REGIONS if sys.argv[1].lower() == "all" else sys.argv[1].split(",")
+    for region in regions:
+        convertRegion(region)
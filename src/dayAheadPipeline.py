@@ -0,0 +1,126 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+import carbonIntensityCalculator
+import forecastMetrics
+import instrumentation
+import trainingOrchestrator
+
+############################# MACRO START #######################################
+# Jul - Dec 2021, same test period as <ISO>_src_prod_forecasts_test_period.csv
+FORECAST_PERIOD = 3
+USE_JOINT_MODEL = False # one model for all sources of the region (see jointForecast.py)
+############################# MACRO END #########################################
+
+def getForecastColumn(source):
+    return "avg_" + source + "_production_forecast"
+
+def getSourceForecasts(ISO, sources, period=FORECAST_PERIOD, joint=None):
+    # Runs the model of each source & keeps the forecasts in memory.
+    # Returns the forecast & actual production frames (UTC time x sources), on the hours 
+    # common to all sources.
+    # joint: use the joint model of the region instead (None: USE_JOINT_MODEL)
+    if (joint is True or (joint is None and USE_JOINT_MODEL is True)):
+        import jointForecast # imports this module
+        return jointForecast.getJointSourceForecasts(ISO, sources, period)
+    import sourceProductionForecast # loads tensorflow, not needed by forecastServer
+    forecasts, actuals = [], []
+    for source in sources:
+        print("Forecasting ", source, "...")
+        periodResults = sourceProductionForecast.runSourceForecast(ISO, source, [period],
+                            writeOutput=False)
+        if (len(periodResults) == 0):
+            raise ValueError("No forecasts for region: " + ISO + ", source: " + source + ", period: " + str(period))
+        result = list(periodResults.values())[0]
+        index = pd.DatetimeIndex(result["dates"], name="UTC time")
+        forecasts.append(pd.Series(result["forecast"], name=getForecastColumn(result["feature"]), index=index))
+        actuals.append(pd.Series(result["actual"], name=getForecastColumn(result["feature"]), index=index))
+    return pd.concat(forecasts, axis=1, join="inner"), pd.concat(actuals, axis=1, join="inner")
+
+def getCarbonFromSourceForecasts(forecasts, columns):
+    # forecasts: days x 24 x sources array, columns: forecast column of each source
+    # Returns the carbon intensity forecasts (days x 24)
+    numDays, numHours, numSources = forecasts.shape
+    emissionFactors = carbonIntensityCalculator.getEmissionFactorVector(columns,
+                        carbonIntensityCalculator.forcast_carbonRateDirect)
+    hourlyForecasts, _ = carbonIntensityCalculator.fillMissingHours(
+                            forecasts.reshape(numDays*numHours, numSources), 0, numSources)
+    carbon = carbonIntensityCalculator.getCarbonIntensity(hourlyForecasts, emissionFactors)
+    return carbon.reshape(numDays, numHours)
+
+def runPipeline(ISO, sources=None, externalForecasts=None, actualCarbonIntensity=None,
+                    outFileName=None):
+    # Day-ahead carbon intensity forecasts of a region, straight from the source models.
+    #   sources - sources to run models for (default: all sources with training data)
+    #   externalForecasts - frame of forecast columns (avg_<source>_production_forecast) for
+    #       sources without a model (eg. solar/wind forecasts from OASIS/ENTSOE), indexed by UTC time
+    #   actualCarbonIntensity - real-time carbon intensity series indexed by UTC time, for MAPE
+    #   outFileName - if given, the result is written out (same layout as the 'f' output
+    #       of carbonIntensityCalculator)
+    if (sources is None):
+        sources = trainingOrchestrator.getRegionSources(ISO)
+    forecastFrame, actualFrame = getSourceForecasts(ISO, sources)
+    print("Source production forecast errors:")
+    forecastMetrics.printSourceErrors(forecastMetrics.getSourceErrors(actualFrame.values, 
+        forecastFrame.loc[actualFrame.index].values, list(actualFrame.columns)))
+    if (externalForecasts is not None):
+        externalColumns = [col for col in externalForecasts.columns if col not in forecastFrame.columns]
+        forecastFrame = forecastFrame.join(externalForecasts[externalColumns], how="inner")
+    numDays = len(forecastFrame) // 24
+    forecastFrame = forecastFrame.iloc[:numDays*24]
+    columns = list(forecastFrame.columns)
+    print("Forecast sources: ", columns, ", days: ", numDays)
+
+    forecasts = forecastFrame.values.reshape(numDays, 24, len(columns)) # days x hours x sources
+    with instrumentation.span("calculate"):
+        carbonForecasts = getCarbonFromSourceForecasts(forecasts, columns)
+
+    result = pd.DataFrame({"UTC time": forecastFrame.index})
+    if (actualCarbonIntensity is not None):
+        actual = actualCarbonIntensity.reindex(forecastFrame.index).values
+        result["carbon_intensity"] = actual
+        dailyAvgMape, avgMape = forecastMetrics.getDailyMape(result["UTC time"].values, actual,
+                                    carbonForecasts.reshape(-1))
+        carbonIntensityCalculator.printMapeSummary(dailyAvgMape, avgMape)
+    result["carbon_from_src_forecasts"] = carbonForecasts.reshape(-1)
+    for i in range(len(columns)):
+        result[columns[i]] = forecasts[:, :, i].reshape(-1)
+    if (outFileName is not None):
+        print("Writing to ", outFileName, "...")
+        with instrumentation.span("write", file=os.path.basename(outFileName)):
+            result.to_csv(outFileName)
+    return result, forecasts, columns
+
+def loadRegionData(ISO):
+    # External source forecasts & real-time carbon intensity from <ISO>.csv (if present)
+    inFileName = "../data/"+ISO+"/"+ISO+".csv"
+    if (not os.path.exists(inFileName)):
+        print(inFileName, " not found, using model forecasts only")
+        return None, None
+    dataset = carbonIntensityCalculator.initialize(inFileName)
+    dataset = carbonIntensityCalculator.calculateCarbonIntensity(dataset,
+                carbonIntensityCalculator.carbonRateDirect, carbonIntensityCalculator.NUM_SOURCES[ISO])
+    # same (tz-naive UTC) hours as the model forecasts
+    dataset.index = pd.DatetimeIndex(pd.to_datetime(dataset["UTC time"], utc=True).dt.tz_localize(None),
+                        name="UTC time")
+    externalColumns = [col for col in dataset.columns if col.startswith("avg_")
+                            and col.endswith("_production_forecast")]
+    return dataset[externalColumns], dataset["carbon_intensity"]
+
+
+if __name__ == "__main__":
+    if (len(sys.argv) < 2 or len(sys.argv) > 3):
+        print("Usage: python3 dayAheadPipeline.py <region> [out_file]")
+        print("Refer github repo for regions.")
+        print("out_file - write the forecasts to this csv file (not written by default)")
+        exit(0)
+    print("DACF: day-ahead carbon intensity forecasts for region: ", sys.argv[1])
+    region = sys.argv[1]
+    outFileName = sys.argv[2] if len(sys.argv) > 2 else None
+    with instrumentation.span("day ahead", region=region):
+        externalForecasts, actualCarbonIntensity = loadRegionData(region)
+        runPipeline(region, None, externalForecasts, actualCarbonIntensity, outFileName)
+    print("Day-ahead carbon intensity forecasts for region: ", sys.argv[1], " done.")
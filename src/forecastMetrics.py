@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+import instrumentation
+
+############################# MACRO START #######################################
+HOURS_PER_DAY = 24
+PERCENTILES = [50, 90, 95]
+EPSILON = 1e-7 # smallest |actual| in the MAPE denominator (as in keras)
+METRICS = ["mape", "rmse", "mae"]
+############################# MACRO END #########################################
+
+# Forecast error metrics in NumPy (no tensorflow), so that forecasts can be evaluated on
+# machines without it. MAPE is in %, as with tf.keras.losses.MeanAbsolutePercentageError.
+
+def getAbsPercentageErrors(actual, forecast):
+    actual = np.asarray(actual, dtype=np.float64)
+    forecast = np.asarray(forecast, dtype=np.float64)
+    return 100 * np.abs(actual - forecast) / np.maximum(np.abs(actual), EPSILON)
+
+def getElementErrors(actual, forecast):
+    # absolute percentage, squared & absolute error of every value, stacked (3 x values)
+    actual = np.asarray(actual, dtype=np.float64).reshape(-1)
+    forecast = np.asarray(forecast, dtype=np.float64).reshape(-1)
+    error = actual - forecast
+    return np.stack([getAbsPercentageErrors(actual, forecast), error * error, np.abs(error)])
+
+def toMetrics(meanErrors):
+    # mean ape, squared & absolute errors -> {"mape", "rmse", "mae"}
+    return {"mape": meanErrors[0], "rmse": np.sqrt(meanErrors[1]), "mae": meanErrors[2]}
+
+def getMAPE(actual, forecast):
+    return np.mean(getAbsPercentageErrors(actual, forecast))
+
+def getRMSE(actual, forecast):
+    error = np.asarray(actual, dtype=np.float64) - np.asarray(forecast, dtype=np.float64)
+    return np.sqrt(np.mean(error * error))
+
+def getMAE(actual, forecast):
+    return np.mean(np.abs(np.asarray(actual, dtype=np.float64) - np.asarray(forecast, dtype=np.float64)))
+
+def getOverallErrors(actual, forecast):
+    return toMetrics(getElementErrors(actual, forecast).mean(axis=1))
+
+def getDailyErrors(actual, forecast, hoursPerDay=HOURS_PER_DAY):
+    # {metric: value of each day}, days of hoursPerDay consecutive values (the last day may be partial)
+    errors = getElementErrors(actual, forecast)
+    numValues = errors.shape[1]
+    if (numValues == 0):
+        return toMetrics(np.zeros((3, 0)))
+    numDays = -(-numValues // hoursPerDay)
+    padded = np.zeros((3, numDays * hoursPerDay))
+    padded[:, :numValues] = errors
+    numHours = np.full(numDays, hoursPerDay)
+    numHours[-1] = numValues - (numDays-1) * hoursPerDay
+    return toMetrics(padded.reshape(3, numDays, hoursPerDay).sum(axis=2) / numHours)
+
+def getHourOfDayErrors(dates, actual, forecast):
+    # {metric: value for each hour of the day (0-23, in the time zone of dates)}
+    hours = pd.DatetimeIndex(dates).hour.to_numpy()
+    errors = getElementErrors(actual, forecast)
+    numHours = np.bincount(hours, minlength=24)
+    sums = np.stack([np.bincount(hours, weights=errors[i], minlength=24) for i in range(3)])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return toMetrics(sums / numHours)
+
+def getSourceErrors(actual, forecast, sources):
+    # actual, forecast: hours x sources. Returns {source: {metric: value}}
+    actual = np.asarray(actual, dtype=np.float64)
+    forecast = np.asarray(forecast, dtype=np.float64)
+    return {sources[i]: getOverallErrors(actual[:, i], forecast[:, i]) for i in range(len(sources))}
+
+def evaluateForecasts(dates, actual, forecast, percentiles=PERCENTILES):
+    # daily, overall, percentile (of the daily values) & hour of day errors
+    daily = getDailyErrors(actual, forecast)
+    return {"daily": daily, "overall": getOverallErrors(actual, forecast),
+            "percentiles": {metric: dict(zip(percentiles, np.percentile(daily[metric], percentiles)))
+                                for metric in METRICS},
+            "hourly": getHourOfDayErrors(dates, actual, forecast)}
+
+# Daily MAPEs (printed) & overall MAPE, as returned by utility.getMape
+def getDailyMape(dates, actual, forecast):
+    dailyMape = getDailyErrors(actual, forecast)["mape"]
+    for i in range(len(dailyMape)):
+        instrumentation.log("Day: ", dates[i*HOURS_PER_DAY], "MAPE: ", dailyMape[i])
+    if (len(dailyMape) == 0):
+        return [], np.nan
+    return list(dailyMape), getMAPE(actual, forecast)
+
+def printHourOfDayErrors(hourlyErrors):
+    print("Hour, " + ", ".join([metric.upper() for metric in METRICS]))
+    for hour in range(24):
+        print(", ".join([str(hour)] + [str(round(hourlyErrors[metric][hour], 4)) for metric in METRICS]))
+    return
+
+def printSourceErrors(sourceErrors):
+    print("Source, " + ", ".join([metric.upper() for metric in METRICS]))
+    for source, errors in sourceErrors.items():
+        print(", ".join([source] + [str(round(errors[metric], 4)) for metric in METRICS]))
+    return
@@ -0,0 +1,175 @@
+import collections
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+import dayAheadPipeline
+import modelRegistry
+import trainingOrchestrator
+import utility
+
+############################# MACRO START #######################################
+PORT = 8080
+MODEL_CACHE_SIZE = 64 # no. of (region, source) models kept loaded
+DATE_TIME_FEATURES = ["hour_sin", "hour_cos", "month_sin", "month_cos", "weekend"]
+TRAINING_WINDOW_HOURS = 24 # input hours of the models (sourceProductionForecast.TRAINING_WINDOW_HOURS)
+# Run the models with the NumPy runtime (numpyModel.py), ie. without loading tensorflow.
+# False: load & run the keras models.
+USE_NUMPY_RUNTIME = True
+############################# MACRO END #########################################
+
+# LRU cache of loaded models & their scaling parameters, keyed by (region, source)
+class ModelCache:
+    def __init__(self, capacity=MODEL_CACHE_SIZE, registry=None):
+        self.capacity = capacity
+        self.registry = registry if registry is not None else modelRegistry.ModelRegistry()
+        self.models = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, region, source):
+        key = (region, source)
+        with self.lock:
+            if (key in self.models):
+                self.models.move_to_end(key)
+                return self.models[key]
+        # latest registered model of the region/source
+        print("Loading ", self.registry.resolve(region, source), "...")
+        if (USE_NUMPY_RUNTIME is True):
+            model, scaler, _ = self.registry.loadNumpy(region, source)
+        else:
+            model, scaler, _ = self.registry.load(region, source)
+        with self.lock:
+            self.models[key] = (model, scaler)
+            self.models.move_to_end(key)
+            while (len(self.models) > self.capacity):
+                self.models.popitem(last=False)
+        return model, scaler
+
+    def preload(self, regions):
+        for region in regions:
+            for source in trainingOrchestrator.getRegionSources(region):
+                try:
+                    self.get(region, source)
+                except KeyError:
+                    print("No registered model for region: ", region, ", source: ", source)
+        return
+
+def getFeatureRows(featureList, sourceFeatures, dates):
+    # sourceFeatures: rows (hours x features, in featureList order), or {feature: hourly values}.
+    # Date & time features missing from the dict are computed from dates (UTC).
+    if (not isinstance(sourceFeatures, dict)):
+        return np.asarray(sourceFeatures, dtype=np.float64)
+    frame = pd.DataFrame(sourceFeatures)
+    if (any(feature not in frame.columns for feature in DATE_TIME_FEATURES)):
+        if (dates is None):
+            raise ValueError("UTC time is needed to compute the date & time features")
+        frame = frame.drop(columns=[col for col in DATE_TIME_FEATURES if col in frame.columns])
+        frame = utility.addDateTimeFeatures(frame, pd.to_datetime(dates, utc=True).values, 0)
+    return frame[featureList].to_numpy(dtype=np.float64)
+
+class ForecastService:
+    def __init__(self, cacheSize=MODEL_CACHE_SIZE):
+        self.cache = ModelCache(cacheSize)
+        self.predictLock = threading.Lock()
+
+    def forecastSource(self, region, source, featureRows):
+        # next 24h production of a source, from (at least) the latest 24h of features
+        model, scaler = self.cache.get(region, source)
+        inputX = scaler.transform(featureRows[-TRAINING_WINDOW_HOURS:])
+        if (USE_NUMPY_RUNTIME is True):
+            predicted = model.predict(inputX[np.newaxis])[0] # no shared state, no lock needed
+        else:
+            with self.predictLock:
+                predicted = model(inputX[np.newaxis], training=False).numpy()[0]
+        return utility.inverseDataScaling(predicted.astype(np.float64), scaler.ftMax[0], scaler.ftMin[0])
+
+    def forecastRegion(self, region, features, dates=None, externalForecasts=None):
+        # features: {source: latest 24h of features}, externalForecasts: {forecast column: 24 values}
+        # Returns the carbon intensity forecasts & the production forecast of each source
+        sourceForecasts = {}
+        for source, sourceFeatures in features.items():
+            featureList = self.cache.get(region, source)[1].featureList
+            featureRows = getFeatureRows(featureList, sourceFeatures, dates)
+            sourceForecasts[dayAheadPipeline.getForecastColumn(featureList[0])] = \
+                self.forecastSource(region, source, featureRows)
+        if (externalForecasts is not None):
+            for col, values in externalForecasts.items():
+                sourceForecasts[col] = np.asarray(values, dtype=np.float64)
+        columns = list(sourceForecasts.keys())
+        forecasts = np.stack([sourceForecasts[col] for col in columns], axis=-1)[np.newaxis]
+        carbon = dayAheadPipeline.getCarbonFromSourceForecasts(forecasts, columns)[0]
+        return carbon, sourceForecasts
+
+def getRequestHandler(service):
+    class ForecastRequestHandler(BaseHTTPRequestHandler):
+        def sendJson(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if (self.path == "/health"):
+                self.sendJson(200, {"status": "ok", "models": [list(key) for key in service.cache.models]})
+            else:
+                self.sendJson(404, {"error": "unknown path " + self.path})
+
+        # POST /forecast {"region": "CISO", "UTC time": [24 timestamps],
+        #   "features": {"coal": {"coal": [...], ...} or [[...], ...], ...},
+        #   "forecasts": {"avg_solar_production_forecast": [...], ...}}
+        def do_POST(self):
+            if (self.path != "/forecast"):
+                self.sendJson(404, {"error": "unknown path " + self.path})
+                return
+            startTime = time.time()
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                if (not isinstance(request, dict) or not isinstance(request.get("features"), dict)):
+                    raise ValueError("request must be a json object with a features object")
+                carbon, sourceForecasts = service.forecastRegion(request["region"], request["features"],
+                                            request.get("UTC time"), request.get("forecasts"))
+            except (KeyError, ValueError) as e:
+                self.sendJson(400, {"error": repr(e)})
+                return
+            except Exception as e:
+                # any other failure still gets a json response (instead of a dropped connection)
+                self.log_error("forecast failed: %r", e)
+                self.sendJson(500, {"error": repr(e)})
+                return
+            self.sendJson(200, {"region": request["region"], "carbon_intensity": carbon.tolist(),
+                "source_forecasts": {col: values.tolist() for col, values in sourceForecasts.items()},
+                "latency_ms": round((time.time() - startTime) * 1000, 2)})
+
+    return ForecastRequestHandler
+
+def runServer(port=PORT, cacheSize=MODEL_CACHE_SIZE, preloadRegions=()):
+    service = ForecastService(cacheSize)
+    service.cache.preload(preloadRegions)
+    server = ThreadingHTTPServer(("127.0.0.1", port), getRequestHandler(service))
+    print("DACF: serving forecasts on http://127.0.0.1:" + str(port) + "/forecast")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    return
+
+
+if __name__ == "__main__":
+    if (len(sys.argv) > 4):
+        print("Usage: python3 forecastServer.py [port] [cache_size] [preload_regions]")
+        print("preload_regions - comma separated list of regions (or all) to load models for at startup")
+        exit(0)
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else PORT
+    cacheSize = int(sys.argv[2]) if len(sys.argv) > 2 else MODEL_CACHE_SIZE
+    preloadRegions = []
+    if (len(sys.argv) > 3):
+        preloadRegions = trainingOrchestrator.REGIONS if sys.argv[3].lower() == "all" else sys.argv[3].split(",")
+    runServer(port, cacheSize, preloadRegions)
@@ -0,0 +1,240 @@
+import concurrent.futures
+import contextlib
+import csv
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import numpy as np
+from keras.callbacks import Callback
+
+import sourceProductionForecast
+import trainingOrchestrator
+
+############################# MACRO START #######################################
+# Values of each hyperparameter to try. Random search also takes ("uniform", low, high) &
+# ("loguniform", low, high) ranges.
+SEARCH_SPACE = {"batchsize": [10, 32, 64], "optim": ["adam", "rmsprop"],
+                "hidden": [[20, 50], [50, 50]], "lr": [1e-2, 1e-3]}
+SEARCH_MODE = "grid" # "grid" or "random"
+NUM_RANDOM_TRIALS = 10
+MAX_EPOCHS = 50
+SEARCH_PERIODS = [0, 1, 2, 3] # each period is tuned on its own train/validation split (see getPeriodSettings)
+PRUNING_RUNGS = [5, 10, 20] # epochs at which a trial is compared with the other trials
+MIN_TRIALS_TO_PRUNE = 4 # no. of other trials that reached a rung before trials are pruned there
+RANDOM_SEED = 0
+RESULTS_DIR = "../data/hyperparameter_search/"
+BEST_HYPERPARAMS_FILE = sourceProductionForecast.BEST_HYPERPARAMS_FILE
+LOG_DIR = trainingOrchestrator.LOG_DIR
+############################# MACRO END #########################################
+
+trialData = {} # (region, source, period): (trainData, valData), per worker process
+
+# Median pruning: at each rung, a trial whose best validation loss so far is worse than the
+# median of the trials that reached the rung before it is stopped. rungLosses is shared by
+# all workers (Manager dict).
+class MedianPruningCallback(Callback):
+    def __init__(self, rungLosses, lock, jobKey, rungs=PRUNING_RUNGS, minTrials=MIN_TRIALS_TO_PRUNE):
+        super().__init__()
+        self.rungLosses = rungLosses
+        self.lock = lock
+        self.jobKey = jobKey
+        self.rungs = rungs
+        self.minTrials = minTrials
+        self.bestLoss = math.inf
+        self.epochs = 0
+        self.pruned = False
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.epochs = epoch+1
+        self.bestLoss = min(self.bestLoss, logs["val_loss"])
+        if (self.epochs not in self.rungs):
+            return
+        key = self.jobKey + (self.epochs,)
+        with self.lock:
+            losses = self.rungLosses.get(key, [])
+            self.rungLosses[key] = losses + [self.bestLoss]
+        if (len(losses) >= self.minTrials and self.bestLoss > np.median(losses)):
+            print("Pruned at epoch ", self.epochs, ", val loss: ", self.bestLoss,
+                    ", median: ", np.median(losses))
+            self.pruned = True
+            self.model.stop_training = True
+
+def sampleValue(values, rng):
+    if (isinstance(values, tuple)):
+        distribution, low, high = values
+        if (distribution == "loguniform"):
+            return float(math.exp(rng.uniform(math.log(low), math.log(high))))
+        return float(rng.uniform(low, high))
+    return rng.choice(values)
+
+# Returns the hyperParams (getANNHyperParams format) of each trial
+def getTrials(searchSpace=SEARCH_SPACE, mode=SEARCH_MODE, numTrials=NUM_RANDOM_TRIALS,
+                maxEpochs=MAX_EPOCHS, seed=RANDOM_SEED):
+    keys = sorted(searchSpace.keys())
+    if (mode == "grid"):
+        if (any(isinstance(searchSpace[key], tuple) for key in keys)):
+            raise ValueError("Ranges can only be used in random search")
+        combinations = list(itertools.product(*[searchSpace[key] for key in keys]))
+    elif (mode == "random"):
+        rng = random.Random(seed)
+        combinations = [[sampleValue(searchSpace[key], rng) for key in keys] for i in range(numTrials)]
+    else:
+        raise ValueError("Unknown search mode: " + str(mode))
+    trials = []
+    for combination in combinations:
+        hyperParams = sourceProductionForecast.getANNHyperParams()
+        for key, value in zip(keys, combination):
+            # trainANN uses the first batch size & optimizer of the lists
+            hyperParams[key] = [value] if key in ("batchsize", "optim") else value
+        hyperParams['epoch'] = maxEpochs
+        trials.append(hyperParams)
+    return trials
+
+def getTrialData(region, source, period):
+    key = (region, source, period)
+    if (key not in trialData):
+        fullDataset, fullDateTime, sourceCol, numFeatures, _ = \
+            sourceProductionForecast.getSourceDataset(region, source)
+        datasetLimiter, _, numTestDays = sourceProductionForecast.getPeriodSettings(period)
+        numRows = sourceProductionForecast.getPeriodRows(fullDateTime, datasetLimiter, numTestDays)
+        if (numRows is None):
+            raise ValueError("Too little data for period " + str(period))
+        trainData, valData, _, _, _, _ = sourceProductionForecast.getPeriodData(fullDataset,
+                    fullDateTime, sourceCol, numFeatures, numRows, numTestDays)
+        trialData[key] = (trainData, valData)
+    return trialData[key]
+
+def getPeriodName(period):
+    return sourceProductionForecast.getPeriodSettings(period)[1][1:]
+
+def runTrial(region, source, period, trialId, hyperParams, rungLosses, lock):
+    os.makedirs(LOG_DIR, exist_ok=True)
+    logFileName = LOG_DIR + "search_" + region + "_" + source + "_" + getPeriodName(period) + "_" + \
+                    str(trialId) + ".log"
+    result = {"trial": trialId, "hyperParams": hyperParams, "val_loss": math.nan, "epochs": 0,
+                "pruned": False, "train_time_sec": 0.0, "error": ""}
+    startTime = time.time()
+    with open(logFileName, "w") as logFile, contextlib.redirect_stdout(logFile):
+        try:
+            trainData, valData = getTrialData(region, source, period)
+            pruning = MedianPruningCallback(rungLosses, lock, (region, source, period))
+            if (sourceProductionForecast.USE_TF_DATA is True):
+                _, _, valLoss = sourceProductionForecast.trainANN(trainData, None, valData, None,
+                                    hyperParams, callbacks=[pruning])
+            else:
+                windowHours = sourceProductionForecast.TRAINING_WINDOW_HOURS
+                X, y = sourceProductionForecast.manipulateTrainingDataShape(trainData, windowHours, windowHours)
+                valX, valY = sourceProductionForecast.manipulateTrainingDataShape(valData, windowHours, windowHours)
+                _, _, valLoss = sourceProductionForecast.trainANN(X, y, valX, valY, hyperParams,
+                                    callbacks=[pruning])
+            result.update({"val_loss": valLoss, "epochs": pruning.epochs, "pruned": pruning.pruned})
+        except Exception as e:
+            result["error"] = repr(e)
+            print("Failed: ", result["error"])
+    result["train_time_sec"] = round(time.time() - startTime, 1)
+    return region, source, period, result
+
+def getBestTrial(results):
+    # pruned trials stopped early, so only completed trials are candidates
+    completed = [result for result in results if not result["pruned"] and result["error"] == ""]
+    if (len(completed) == 0):
+        return None
+    return min(completed, key=lambda result: result["val_loss"])
+
+def writeResults(region, source, period, results, resultsDir=RESULTS_DIR):
+    os.makedirs(resultsDir, exist_ok=True)
+    outFileName = resultsDir + region + "_" + source + "_" + getPeriodName(period) + ".csv"
+    print("Writing trials to ", outFileName, "...")
+    fields = ["trial", "val_loss", "epochs", "pruned", "train_time_sec", "hyperparams", "error"]
+    with open(outFileName, 'w') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        csvwriter.writerow(fields)
+        for result in sorted(results, key=lambda result: (result["pruned"], result["val_loss"])):
+            csvwriter.writerow([result["trial"], result["val_loss"], result["epochs"], result["pruned"],
+                result["train_time_sec"], json.dumps(result["hyperParams"]), result["error"]])
+    return
+
+def updateBestHyperParams(bestTrials, searchKeys=SEARCH_SPACE.keys(), fileName=BEST_HYPERPARAMS_FILE):
+    # {region: {source: {period name: {"hyperParams", "valLoss"}}}}, read by getANNHyperParams.
+    # Only the searched hyperparameters are kept (not the trials' epochs).
+    best = {}
+    if (os.path.exists(fileName)):
+        with open(fileName) as f:
+            best = json.load(f)
+    for (region, source, period), result in bestTrials.items():
+        sourceBest = best.setdefault(region, {}).setdefault(source, {})
+        for key in ("hyperParams", "valLoss", "period"): # old format (one config for all periods)
+            sourceBest.pop(key, None)
+        sourceBest[getPeriodName(period)] = {"hyperParams": {key: result["hyperParams"][key] for key in searchKeys},
+            "valLoss": result["val_loss"]}
+    tmpFileName = fileName + ".tmp"
+    with open(tmpFileName, "w") as f:
+        json.dump(best, f, indent=2)
+    os.replace(tmpFileName, fileName)
+    return
+
+def runSearch(regions, sources, mode=SEARCH_MODE, numTrials=NUM_RANDOM_TRIALS, numWorkers=None,
+                threadsPerWorker=trainingOrchestrator.THREADS_PER_WORKER, periods=SEARCH_PERIODS):
+    jobs = [(region, source, period) for region, source in trainingOrchestrator.getJobs(regions, sources)
+            for period in periods]
+    trials = getTrials(SEARCH_SPACE, mode, numTrials, MAX_EPOCHS, RANDOM_SEED)
+    if (numWorkers is None):
+        numWorkers = max(1, (os.cpu_count() or 1) // threadsPerWorker)
+    numWorkers = max(1, min(numWorkers, len(jobs)*len(trials)))
+    print("Jobs: ", len(jobs), ", trials per job: ", len(trials), ", workers: ", numWorkers)
+
+    results = {job: [] for job in jobs}
+    startTime = time.time()
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager:
+        rungLosses, lock = manager.dict(), manager.Lock()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=numWorkers, mp_context=context,
+                    initializer=trainingOrchestrator.initWorker, initargs=(threadsPerWorker,)) as executor:
+            futures = [executor.submit(runTrial, region, source, period, trialId, hyperParams,
+                        rungLosses, lock) for region, source, period in jobs
+                        for trialId, hyperParams in enumerate(trials)]
+            for future in concurrent.futures.as_completed(futures):
+                region, source, period, result = future.result()
+                status = "failed: " + result["error"] if result["error"] != "" else \
+                    ("pruned" if result["pruned"] else "done") + ", val loss: " + str(result["val_loss"])
+                print(region, source, getPeriodName(period), "trial ", result["trial"], "(",
+                        result["train_time_sec"], "s): ", status)
+                results[(region, source, period)].append(result)
+    print("All trials done in ", round(time.time() - startTime, 1), " s")
+
+    bestTrials = {}
+    for (region, source, period), jobResults in results.items():
+        writeResults(region, source, period, jobResults)
+        bestTrial = getBestTrial(jobResults)
+        if (bestTrial is None):
+            print("No completed trials for region: ", region, ", source: ", source, ", period: ", getPeriodName(period))
+            continue
+        print("Best for region: ", region, ", source: ", source, ", period: ", getPeriodName(period), ": trial ",
+                bestTrial["trial"], ", val loss: ", bestTrial["val_loss"], ", ", bestTrial["hyperParams"])
+        bestTrials[(region, source, period)] = bestTrial
+    updateBestHyperParams(bestTrials)
+    return bestTrials
+
+
+if __name__ == "__main__":
+    if (len(sys.argv) < 3 or len(sys.argv) > 8):
+        print("Usage: python3 hyperparameterSearch.py <regions> <sources> [grid/random] [num_trials] [num_workers] [threads_per_worker] [periods]")
+        print("regions, sources - comma separated lists, or all")
+        print("num_trials - no. of random search trials (the grid is given by SEARCH_SPACE)")
+        print("periods - comma separated list of periods (0-3), each tuned separately (default: all)")
+        print("Example: python3 hyperparameterSearch.py CISO coal,nat_gas random 20 8 1")
+        exit(0)
+    regions = "all" if sys.argv[1].lower() == "all" else sys.argv[1].split(",")
+    sources = "all" if sys.argv[2].lower() == "all" else sys.argv[2].split(",")
+    mode = sys.argv[3] if len(sys.argv) > 3 else SEARCH_MODE
+    numTrials = int(sys.argv[4]) if len(sys.argv) > 4 else NUM_RANDOM_TRIALS
+    numWorkers = int(sys.argv[5]) if len(sys.argv) > 5 else None
+    threadsPerWorker = int(sys.argv[6]) if len(sys.argv) > 6 else trainingOrchestrator.THREADS_PER_WORKER
+    periods = [int(period) for period in sys.argv[7].split(",")] if len(sys.argv) > 7 else SEARCH_PERIODS
+    runSearch(regions, sources, mode, numTrials, numWorkers, threadsPerWorker, periods)
@@ -0,0 +1,139 @@
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+############################# MACRO START #######################################
+# Set by environment variables, so that training workers (spawned processes) use the same
+# settings. configure() changes them for the current process.
+TRACE_FILE = os.environ.get("DACF_TRACE_FILE") or None # spans are appended here (JSON lines), None: off
+QUIET = os.environ.get("DACF_QUIET", "0").lower() in ("1", "true", "yes") # no verbose prints (log)
+############################# MACRO END #########################################
+
+# Named spans over the pipeline stages (load, feature engineering, fill, scale, window,
+# fit, predict, inverse-scale, write, ...). Each span records its wall time, CPU time
+# (of the process) & the change in resident memory, and is written as one JSON line:
+#   {"name", "start", "wallSec", "cpuSec", "rssDeltaMB", "peakRssMB", "pid", "parent",
+#    "depth", "error", <attributes>}
+# Attributes (eg. region, source, period) are passed to span() & inherited by the spans
+# nested in it. python3 instrumentation.py <trace file> summarizes a trace.
+
+spanStack = threading.local()
+writeLock = threading.Lock()
+
+def configure(traceFile=None, quiet=None):
+    global TRACE_FILE, QUIET
+    if (traceFile is not None):
+        TRACE_FILE = traceFile or None # "" turns tracing off
+    if (quiet is not None):
+        QUIET = quiet
+    return
+
+def log(*args, **kwargs):
+    # print for verbose output (data frames, shapes etc.), off in quiet mode
+    if (QUIET is False):
+        print(*args, **kwargs)
+    return
+
+def getRssBytes():
+    # current resident memory (Linux), else the peak
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return getPeakRssBytes()
+
+def getPeakRssBytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 # bytes on macOS, kB on Linux
+
+def getStack():
+    if (not hasattr(spanStack, "spans")):
+        spanStack.spans = []
+    return spanStack.spans
+
+def writeRecord(record, traceFile):
+    directory = os.path.dirname(traceFile)
+    if (directory != ""):
+        os.makedirs(directory, exist_ok=True)
+    line = json.dumps(record, default=str) + "\n"
+    # one write of a line in append mode, so lines of concurrent processes don't interleave
+    with writeLock, open(traceFile, "a") as f:
+        f.write(line)
+    return
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    stack = getStack()
+    parent = stack[-1] if len(stack) > 0 else None
+    if (parent is not None):
+        attributes = dict(parent["attributes"], **attributes)
+    current = {"name": name, "attributes": attributes}
+    stack.append(current)
+    error = None
+    startTime, startWall, startCpu, startRss = time.time(), time.perf_counter(), time.process_time(), getRssBytes()
+    try:
+        yield current
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        wallTime, cpuTime = time.perf_counter() - startWall, time.process_time() - startCpu
+        stack.pop()
+        traceFile = TRACE_FILE
+        if (traceFile is not None):
+            record = {"name": name, "start": startTime, "wallSec": round(wallTime, 6),
+                      "cpuSec": round(cpuTime, 6), "rssDeltaMB": round((getRssBytes() - startRss) / 2**20, 3),
+                      "peakRssMB": round(getPeakRssBytes() / 2**20, 1), "pid": os.getpid(),
+                      "parent": parent["name"] if parent is not None else None, "depth": len(stack),
+                      "error": error}
+            record.update(attributes)
+            writeRecord(record, traceFile)
+
+def iterSpans(name, iterable, **attributes):
+    # yields the items of iterable, each next() in a span (eg. chunks of a csv reader)
+    iterator = iter(iterable)
+    while True:
+        with span(name, **attributes):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+def readTrace(traceFile):
+    with open(traceFile) as f:
+        return [json.loads(line) for line in f if line.strip() != ""]
+
+def summarizeTrace(records, groupBy=("region", "source")):
+    # {(group values..., span name): {"count", "wallSec", "cpuSec", "rssDeltaMB"}} (totals)
+    summary = {}
+    for record in records:
+        key = tuple(record.get(attribute) for attribute in groupBy) + (record["name"],)
+        totals = summary.setdefault(key, {"count": 0, "wallSec": 0.0, "cpuSec": 0.0, "rssDeltaMB": 0.0})
+        totals["count"] += 1
+        for field in ["wallSec", "cpuSec", "rssDeltaMB"]:
+            totals[field] += record[field]
+    return summary
+
+def printSummary(summary, groupBy=("region", "source")):
+    print(", ".join(list(groupBy) + ["span", "count", "wall_sec", "cpu_sec", "rss_delta_mb"]))
+    for key in sorted(summary.keys(), key=lambda key: tuple(str(value) for value in key)):
+        totals = summary[key]
+        print(", ".join([str(value) for value in key] + [str(totals["count"]), str(round(totals["wallSec"], 3)),
+                str(round(totals["cpuSec"], 3)), str(round(totals["rssDeltaMB"], 1))]))
+    return
+
+
+if __name__ == "__main__":
+    if (len(sys.argv) < 2 or len(sys.argv) > 3):
+        print("Usage: python3 instrumentation.py <trace file> [group_by]")
+        print("group_by - comma separated span attributes (default: region,source)")
+        print("Traces are written by the pipeline scripts when DACF_TRACE_FILE is set, eg.")
+        print("   DACF_TRACE_FILE=../logs/trace.jsonl DACF_QUIET=1 python3 sourceProductionForecast.py CISO coal")
+        exit(0)
+    groupBy = tuple(sys.argv[2].split(",")) if len(sys.argv) > 2 else ("region", "source")
+    printSummary(summarizeTrace(readTrace(sys.argv[1]), groupBy), groupBy)
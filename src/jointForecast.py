@@ -0,0 +1,186 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import dayAheadPipeline
+import forecastMetrics
+import instrumentation
+import modelRegistry
+import sourceProductionForecast
+import trainingOrchestrator
+
+############################# MACRO START #######################################
+JOINT_SOURCE = "joint" # "source" of the joint models in the model registry
+JOINT_HIDDEN = [64, 128] # hidden layer sizes, wider than per-source models (24 x sources outputs)
+DATE_TIME_FEATURES = ["hour_sin", "hour_cos", "month_sin", "month_cos", "weekend"] # see utility.addDateTimeFeatures
+MODEL_REGISTRY_DIR = sourceProductionForecast.MODEL_REGISTRY_DIR
+############################# MACRO END #########################################
+
+# One model per region that forecasts all of its sources: the input is the union of the
+# features of the per-source models (the sources, date/time features & the weather
+# forecasts used for solar/wind/hydro) and the output is 24 hours x sources, ie. one
+# training & one inference per region instead of one per source.
+
+# Joins the training data of the sources on UTC time. Columns: the sources (in order), the
+# date/time features, then the other features of the per-source models.
+# Returns (dataset, dateTime, source column names).
+def getJointDataset(ISO, sources):
+    sourceFrames, extraFrames, dateTimeFrame = [], {}, None
+    for source in sources:
+        fullDataset, _, sourceCol, numFeatures, _ = sourceProductionForecast.getSourceDataset(ISO, source)
+        sourceFrames.append(fullDataset.iloc[:, [sourceCol]])
+        if (dateTimeFrame is None):
+            dateTimeFrame = fullDataset[DATE_TIME_FEATURES]
+        for col in range(sourceCol+1, sourceCol+numFeatures):
+            feature = fullDataset.columns[col]
+            if (feature not in DATE_TIME_FEATURES and feature not in extraFrames):
+                extraFrames[feature] = fullDataset.iloc[:, [col]]
+    sourceColumns = [frame.columns[0] for frame in sourceFrames]
+    extraFrames = [frame for feature, frame in extraFrames.items() if feature not in sourceColumns]
+    dataset = pd.concat(sourceFrames + [dateTimeFrame] + extraFrames, axis=1, join="inner")
+    print("Joint features: ", list(dataset.columns), ", rows: ", len(dataset))
+    return dataset, dataset.index.values, sourceColumns
+
+def getJointHyperParams(ISO, period):
+    hyperParams = sourceProductionForecast.getANNHyperParams(ISO, JOINT_SOURCE, period)
+    hyperParams['hidden'] = JOINT_HIDDEN
+    return hyperParams
+
+def writeJointForecastFile(outFileName, dates, actual, forecast, sourceColumns):
+    # UTC time, forecast of each source (avg_<source>_production_forecast), actual of each source
+    print("Writing to ", outFileName, "...")
+    result = pd.DataFrame({"UTC time": dates})
+    for i in range(len(sourceColumns)):
+        result[dayAheadPipeline.getForecastColumn(sourceColumns[i])] = forecast[:, i]
+    for i in range(len(sourceColumns)):
+        result[sourceColumns[i] + "_actual"] = actual[:, i]
+    result.to_csv(outFileName, index=False)
+    return
+
+# Trains & tests the joint model of a region over the given periods (0-3), like
+# sourceProductionForecast.runSourceForecast. Returns {period: {"sources", "dates",
+# "actual", "forecast" (hours x sources, unscaled), "errors", "train_time", "val_loss"}}.
+def runJointForecast(ISO, sources=None, periods=range(4), writeOutput=True):
+    if (sources is None):
+        sources = trainingOrchestrator.getRegionSources(ISO)
+    periodResults = {}
+    registry = modelRegistry.ModelRegistry(MODEL_REGISTRY_DIR)
+    with instrumentation.span("joint forecast", region=ISO, source=JOINT_SOURCE):
+        dataset, dateTime, sourceColumns = getJointDataset(ISO, sources)
+        numSources = len(sourceColumns)
+        windowHours = sourceProductionForecast.TRAINING_WINDOW_HOURS
+        for period in periods:
+            with instrumentation.span("period", period=period):
+                # the joint data (hours common to all sources) is cut like the per-source data
+                datasetLimiter, outFileSuffix, numTestDays = sourceProductionForecast.getPeriodSettings(period)
+                numRows = sourceProductionForecast.getPeriodRows(dateTime, datasetLimiter, numTestDays)
+                if (numRows is None):
+                    continue
+                trainData, valData, testData, testDates, featureList, scaler = \
+                    sourceProductionForecast.getPeriodData(dataset, dateTime, 0, dataset.shape[1],
+                        numRows, numTestDays)
+
+                if (sourceProductionForecast.USE_TF_DATA is True):
+                    X, y, valX, valY = trainData, None, valData, None
+                else:
+                    with instrumentation.span("window"):
+                        X, y = sourceProductionForecast.manipulateTrainingDataShape(trainData, windowHours,
+                                    windowHours, numSources)
+                        valX, valY = sourceProductionForecast.manipulateTrainingDataShape(valData, windowHours,
+                                    windowHours, numSources)
+
+                hyperParams = getJointHyperParams(ISO, period)
+                print("\nStarting joint training (", numSources, " sources)...")
+                startTime = time.time()
+                with instrumentation.span("fit"):
+                    model, numFeatures, valLoss = sourceProductionForecast.trainANN(X, y, valX, valY,
+                                                    hyperParams, numTargets=numSources)
+                trainTime = time.time() - startTime
+                print("***** Training done *****")
+                with instrumentation.span("write", file="model registry"):
+                    registry.register(ISO, JOINT_SOURCE, outFileSuffix[1:], 0, model, scaler, hyperParams,
+                        valLoss, extraMeta={"sources": sourceColumns, "trainTime": trainTime})
+
+                # days x 24 x sources (day-ahead inputs are only observed data, as for 24h
+                # per-source forecasts)
+                history = valData[-windowHours:, :].tolist()
+                with instrumentation.span("predict"):
+                    predictedData = sourceProductionForecast.getBatchedDayAheadForecasts(model, history,
+                                        testData, windowHours)
+                numHours = predictedData.shape[0] * predictedData.shape[1]
+                with instrumentation.span("inverse-scale"):
+                    sourceIdx = np.arange(numSources)
+                    forecast = scaler.inverseTransform(predictedData.reshape(numHours, numSources), sourceIdx)
+                    actual = scaler.inverseTransform(testData[:numHours, :numSources], sourceIdx)
+                dates = testDates[:numHours]
+                errors = forecastMetrics.getSourceErrors(actual, forecast, sourceColumns)
+                forecastMetrics.printSourceErrors(errors)
+
+                if (writeOutput is True):
+                    outFileName = "../data/"+ISO+"/fuel_forecast/"+ISO+"_src_prod_forecast_joint"+outFileSuffix+".csv"
+                    with instrumentation.span("write", file=os.path.basename(outFileName)):
+                        writeJointForecastFile(outFileName, dates, actual, forecast, sourceColumns)
+                periodResults[outFileSuffix[1:]] = {"sources": sourceColumns, "dates": dates, "actual": actual,
+                    "forecast": forecast, "errors": errors, "train_time": trainTime, "val_loss": valLoss}
+    return periodResults
+
+def getJointSourceForecasts(ISO, sources, period=dayAheadPipeline.FORECAST_PERIOD):
+    # dayAheadPipeline.getSourceForecasts from the joint model: forecast & actual production
+    # frames (UTC time x avg_<source>_production_forecast)
+    periodResults = runJointForecast(ISO, sources, [period], writeOutput=False)
+    if (len(periodResults) == 0):
+        raise ValueError("No joint forecasts for region: " + ISO + ", period: " + str(period))
+    result = list(periodResults.values())[0]
+    index = pd.DatetimeIndex(result["dates"], name="UTC time")
+    columns = [dayAheadPipeline.getForecastColumn(source) for source in result["sources"]]
+    return (pd.DataFrame(result["forecast"], columns=columns, index=index),
+            pd.DataFrame(result["actual"], columns=columns, index=index))
+
+# Per-source errors & run time (data loading, training & inference of all sources) of the
+# joint model vs. the per-source models, on the hours forecast by both.
+def compareWithSourceModels(ISO, sources=None, period=dayAheadPipeline.FORECAST_PERIOD):
+    if (sources is None):
+        sources = trainingOrchestrator.getRegionSources(ISO)
+    startTime = time.time()
+    sourceForecasts, sourceActuals = dayAheadPipeline.getSourceForecasts(ISO, sources, period, joint=False)
+    sourceModelsTime = time.time() - startTime
+    startTime = time.time()
+    jointForecasts, _ = getJointSourceForecasts(ISO, sources, period)
+    jointModelTime = time.time() - startTime
+
+    hours = sourceForecasts.index.intersection(jointForecasts.index)
+    columns = [col for col in sourceForecasts.columns if col in jointForecasts.columns]
+    if (len(hours) == 0):
+        print("No hours forecast by both the per-source & the joint models")
+        return None
+    actual = sourceActuals.loc[hours, columns].values
+    sourceErrors = forecastMetrics.getSourceErrors(actual, sourceForecasts.loc[hours, columns].values, columns)
+    jointErrors = forecastMetrics.getSourceErrors(actual, jointForecasts.loc[hours, columns].values, columns)
+    print("Region: ", ISO, ", hours compared: ", len(hours))
+    print("Source, " + ", ".join([metric.upper() + " (" + model + ")" for metric in forecastMetrics.METRICS
+                                    for model in ["per-source", "joint"]]))
+    for col in columns:
+        print(", ".join([col] + [str(round(errors[col][metric], 4)) for metric in forecastMetrics.METRICS
+                                    for errors in [sourceErrors, jointErrors]]))
+    print("Run time (s), per-source models: ", round(sourceModelsTime, 1), ", joint model: ",
+            round(jointModelTime, 1), " (x", round(sourceModelsTime / max(jointModelTime, 1e-9), 1), ")")
+    return {"sourceErrors": sourceErrors, "jointErrors": jointErrors, "sourceModelsTime": sourceModelsTime,
+            "jointModelTime": jointModelTime}
+
+
+if __name__ == "__main__":
+    if (len(sys.argv) < 2 or len(sys.argv) > 4 or (len(sys.argv) == 4 and sys.argv[3] != "compare")):
+        print("Usage: python3 jointForecast.py <region> [period] [compare]")
+        print("period - 0-3 (default: all periods, or ", dayAheadPipeline.FORECAST_PERIOD, " with compare)")
+        print("compare - also run the per-source models & compare the errors & run times")
+        print("Example: python3 jointForecast.py CISO 3 compare")
+        exit(0)
+    region = sys.argv[1]
+    if (len(sys.argv) == 4):
+        compareWithSourceModels(region, None, int(sys.argv[2]))
+    else:
+        periods = [int(sys.argv[2])] if len(sys.argv) > 2 else range(4)
+        runJointForecast(region, None, periods)
@@ -0,0 +1,192 @@
+import errno
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+
+import numpyModel
+import utility
+
+############################# MACRO START #######################################
+REGISTRY_DIR = "../models/"
+MODEL_FILE = "model.h5"
+NUMPY_MODEL_FILE = "model.npz" # weights & scaler for inference without tensorflow (numpyModel.py)
+SCALER_FILE = "scaler.npz"
+META_FILE = "meta.json"
+LATEST_FILE = "latest.json"
+MAX_MOVE_RETRIES = 100 # attempts to replace an entry that other writers keep replacing
+############################# MACRO END #########################################
+
+# Trained models, stored per (region, source, period, experiment):
+#   <root>/<region>/<source>/<period>/expt_<n>/{model.h5, model.npz, scaler.npz, meta.json}
+# meta.json holds the feature list, scaler min/max, hyperparameters, validation loss &
+# the key of the training data. Entries are written to a temporary directory & renamed
+# into place, so concurrent trainings never see (or leave) a partially written model.
+# <root>/<region>/<source>/latest.json points to the most recently registered entry.
+class ModelRegistry:
+    def __init__(self, root=REGISTRY_DIR):
+        self.root = root
+
+    def getEntryDir(self, region, source, period, experiment=0):
+        return os.path.join(self.root, region, source, str(period), "expt_" + str(experiment))
+
+    def register(self, region, source, period, experiment, model, scaler, hyperParams, valLoss,
+                    dataKey=None, extraMeta=None):
+        sourceDir = os.path.join(self.root, region, source)
+        os.makedirs(sourceDir, exist_ok=True)
+        tmpDir = os.path.join(sourceDir, ".tmp_" + uuid.uuid4().hex)
+        os.makedirs(tmpDir)
+        meta = {"region": region, "source": source, "period": str(period), "experiment": experiment,
+                "features": list(scaler.featureList or []), "ftMin": scaler.ftMin.tolist(),
+                "ftMax": scaler.ftMax.tolist(), "hyperParams": hyperParams, "valLoss": valLoss,
+                "dataKey": dataKey, "created": time.time()}
+        if (extraMeta is not None):
+            meta.update(extraMeta)
+        try:
+            model.save(os.path.join(tmpDir, MODEL_FILE))
+            try:
+                numpyModel.exportModel(model, scaler, os.path.join(tmpDir, NUMPY_MODEL_FILE))
+            except ValueError as e:
+                print("Model not exported for the NumPy runtime: ", e)
+            scaler.save(os.path.join(tmpDir, SCALER_FILE))
+            with open(os.path.join(tmpDir, META_FILE), "w") as f:
+                json.dump(meta, f, indent=2, default=str)
+            entryDir = self.getEntryDir(region, source, period, experiment)
+            os.makedirs(os.path.dirname(entryDir), exist_ok=True)
+            self.moveIntoPlace(tmpDir, entryDir, sourceDir)
+        except BaseException:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+            raise
+        self.writeJson(os.path.join(sourceDir, LATEST_FILE),
+                        {"period": str(period), "experiment": experiment})
+        return entryDir
+
+    def moveIntoPlace(self, tmpDir, entryDir, sourceDir):
+        # A non-empty directory can't be replaced in one rename, so an existing entry is
+        # moved aside first. Retried if another writer moves/replaces it in between, any
+        # other error (eg. permissions, a missing tmpDir) is raised.
+        for attempt in range(MAX_MOVE_RETRIES):
+            try:
+                os.rename(tmpDir, entryDir)
+                return
+            except OSError as e:
+                if (e.errno not in (errno.ENOTEMPTY, errno.EEXIST)):
+                    raise
+            oldDir = os.path.join(sourceDir, ".old_" + uuid.uuid4().hex)
+            try:
+                os.rename(entryDir, oldDir)
+            except FileNotFoundError:
+                continue
+            shutil.rmtree(oldDir, ignore_errors=True)
+        raise OSError("Could not move " + tmpDir + " to " + entryDir + " after " + 
+                        str(MAX_MOVE_RETRIES) + " attempts")
+
+    def writeJson(self, fileName, obj):
+        tmpFileName = fileName + ".tmp" + uuid.uuid4().hex
+        with open(tmpFileName, "w") as f:
+            json.dump(obj, f)
+        os.replace(tmpFileName, fileName)
+        return
+
+    def resolve(self, region, source, period=None, experiment=0):
+        # period None: latest registered entry
+        if (period is None):
+            latestFileName = os.path.join(self.root, region, source, LATEST_FILE)
+            if (not os.path.exists(latestFileName)):
+                raise KeyError("No registered model for region: " + region + ", source: " + source)
+            with open(latestFileName) as f:
+                latest = json.load(f)
+            period, experiment = latest["period"], latest["experiment"]
+        entryDir = self.getEntryDir(region, source, period, experiment)
+        if (not os.path.exists(os.path.join(entryDir, META_FILE))):
+            raise KeyError("No registered model for region: " + region + ", source: " + source +
+                            ", period: " + str(period) + ", experiment: " + str(experiment))
+        return entryDir
+
+    def getMeta(self, region, source, period=None, experiment=0):
+        with open(os.path.join(self.resolve(region, source, period, experiment), META_FILE)) as f:
+            return json.load(f)
+
+    def getScaler(self, region, source, period=None, experiment=0):
+        entryDir = self.resolve(region, source, period, experiment)
+        return utility.FeatureScaler.load(os.path.join(entryDir, SCALER_FILE))
+
+    def getModelFileName(self, region, source, period=None, experiment=0):
+        return os.path.join(self.resolve(region, source, period, experiment), MODEL_FILE)
+
+    def getNumpyModelFileName(self, region, source, period=None, experiment=0):
+        return os.path.join(self.resolve(region, source, period, experiment), NUMPY_MODEL_FILE)
+
+    def hasNumpyModel(self, region, source, period=None, experiment=0):
+        return os.path.exists(self.getNumpyModelFileName(region, source, period, experiment))
+
+    def loadNumpy(self, region, source, period=None, experiment=0):
+        # returns (numpyModel.NumpyModel, scaler, meta), without tensorflow if the entry has
+        # a NumPy model file (else it is converted from the keras model)
+        entryDir = self.resolve(region, source, period, experiment)
+        with open(os.path.join(entryDir, META_FILE)) as f:
+            meta = json.load(f)
+        if (os.path.exists(os.path.join(entryDir, NUMPY_MODEL_FILE))):
+            model = numpyModel.NumpyModel.load(os.path.join(entryDir, NUMPY_MODEL_FILE))
+        else:
+            kerasModel, scaler, _ = self.load(region, source, period, experiment)
+            model = numpyModel.fromKeras(kerasModel, scaler)
+        return model, model.scaler, meta
+
+    def load(self, region, source, period=None, experiment=0):
+        # returns (keras model, scaler, meta)
+        from keras.models import load_model
+        entryDir = self.resolve(region, source, period, experiment)
+        model = load_model(os.path.join(entryDir, MODEL_FILE))
+        scaler = utility.FeatureScaler.load(os.path.join(entryDir, SCALER_FILE))
+        with open(os.path.join(entryDir, META_FILE)) as f:
+            meta = json.load(f)
+        return model, scaler, meta
+
+    def isUpToDate(self, region, source, period, experiment, dataKey, hyperParams):
+        # True if the entry was trained on the same data with the same hyperparameters
+        try:
+            meta = self.getMeta(region, source, period, experiment)
+        except KeyError:
+            return False
+        return (meta.get("dataKey") == dataKey and
+                json.dumps(meta.get("hyperParams"), sort_keys=True, default=str) ==
+                json.dumps(hyperParams, sort_keys=True, default=str))
+
+    def listEntries(self, region=None, source=None):
+        entries = []
+        if (not os.path.isdir(self.root)):
+            return entries
+        regions = [region] if region is not None else sorted(os.listdir(self.root))
+        for reg in regions:
+            regionDir = os.path.join(self.root, reg)
+            if (not os.path.isdir(regionDir)):
+                continue
+            sources = [source] if source is not None else sorted(os.listdir(regionDir))
+            for src in sources:
+                sourceDir = os.path.join(regionDir, src)
+                if (src.startswith(".") or not os.path.isdir(sourceDir)):
+                    continue
+                for period in sorted(os.listdir(sourceDir)):
+                    periodDir = os.path.join(sourceDir, period)
+                    if (period.startswith(".") or not os.path.isdir(periodDir)):
+                        continue
+                    for expt in sorted(os.listdir(periodDir)):
+                        metaFileName = os.path.join(periodDir, expt, META_FILE)
+                        if (os.path.exists(metaFileName)):
+                            with open(metaFileName) as f:
+                                entries.append(json.load(f))
+        return entries
+
+
+if __name__ == "__main__":
+    if (len(sys.argv) > 3):
+        print("Usage: python3 modelRegistry.py [region] [source]")
+        exit(0)
+    region = sys.argv[1] if len(sys.argv) > 1 else None
+    source = sys.argv[2] if len(sys.argv) > 2 else None
+    for meta in ModelRegistry().listEntries(region, source):
+        print(meta["region"], meta["source"], meta["period"], "expt_" + str(meta["experiment"]),
+                "val_loss: ", meta["valLoss"], ", features: ", meta["features"])
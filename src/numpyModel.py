@@ -0,0 +1,233 @@
+import sys
+import time
+
+import numpy as np
+
+import utility
+
+############################# MACRO START #######################################
+FORMAT_VERSION = 1
+DTYPE = np.float32 # keras computes in float32, so the outputs match it
+TOLERANCE = 1e-4 # max. abs. difference from keras (scaled outputs) accepted by verify
+NUM_VERIFY_DAYS = 256
+############################# MACRO END #########################################
+
+# Inference of the trained ANNs (Flatten -> Dense -> ... -> Dense [-> Reshape], see
+# sourceProductionForecast.trainANN) with NumPy only, ie. without importing TensorFlow.
+# A model is exported to one .npz file with the weights & biases of each Dense layer, its
+# activation, the input & output shapes and the scaling parameters (as in FeatureScaler):
+#   W<i>, b<i>, activations, inputShape, outputShape, ftMin, ftMax, featureList, version
+# The registry writes this file (model.npz) next to each model.h5.
+
+ACTIVATIONS = {"linear": lambda x: x,
+               "relu": lambda x: np.maximum(x, 0),
+               "sigmoid": lambda x: 1 / (1 + np.exp(-x)),
+               "tanh": np.tanh,
+               "softplus": lambda x: np.logaddexp(x, 0),
+               "elu": lambda x: np.where(x > 0, x, np.expm1(np.minimum(x, 0)))}
+IDENTITY_LAYERS = ["InputLayer", "Dropout"] # no-ops at inference
+
+class NumpyModel:
+    def __init__(self, weights, biases, activations, inputShape, outputShape, scaler=None):
+        self.weights = [np.asarray(w, dtype=DTYPE) for w in weights]
+        self.biases = [np.asarray(b, dtype=DTYPE) for b in biases]
+        self.activations = list(activations)
+        self.inputShape = tuple(int(dim) for dim in inputShape) # (hours, features)
+        self.outputShape = tuple(int(dim) for dim in outputShape) # (hours,) or (hours, sources)
+        self.scaler = scaler
+        for activation in self.activations:
+            if (activation not in ACTIVATIONS):
+                raise ValueError("Unsupported activation: " + str(activation))
+
+    def predict(self, X):
+        # X: scaled inputs (batch x hours x features), returns scaled outputs (batch x outputShape)
+        X = np.asarray(X, dtype=DTYPE)
+        out = X.reshape(len(X), -1) # Flatten (row-major, as keras)
+        for w, b, activation in zip(self.weights, self.biases, self.activations):
+            out = ACTIVATIONS[activation](out @ w + b)
+        return out.reshape((len(X),) + self.outputShape)
+
+    def getOutputCols(self):
+        # columns of the scaled features that the outputs are (first ones)
+        return 0 if len(self.outputShape) == 1 else np.arange(self.outputShape[1])
+
+    def forecast(self, featureRows):
+        # featureRows: unscaled features (hours x features, or days x hours x features).
+        # Returns the production forecasts in MWh (per day if days are given).
+        featureRows = np.asarray(featureRows, dtype=np.float64)
+        isSingle = (featureRows.ndim == 2)
+        X = self.scaler.transform(featureRows[np.newaxis] if isSingle else featureRows)
+        forecasts = self.scaler.inverseTransform(self.predict(X).astype(np.float64), self.getOutputCols())
+        return forecasts[0] if isSingle else forecasts
+
+    def save(self, fileName):
+        arrays = {"version": FORMAT_VERSION, "activations": np.array(self.activations, dtype=str),
+                  "inputShape": np.array(self.inputShape), "outputShape": np.array(self.outputShape)}
+        for i in range(len(self.weights)):
+            arrays["W" + str(i)], arrays["b" + str(i)] = self.weights[i], self.biases[i]
+        if (self.scaler is not None):
+            featureList = [] if self.scaler.featureList is None else self.scaler.featureList
+            arrays.update({"ftMin": self.scaler.ftMin, "ftMax": self.scaler.ftMax,
+                           "featureList": np.array(featureList, dtype=str)})
+        with open(fileName, "wb") as f: # np.savez would append .npz to other names
+            np.savez(f, **arrays)
+        return
+
+    @staticmethod
+    def load(fileName):
+        with np.load(fileName) as arrays:
+            if (int(arrays["version"]) > FORMAT_VERSION):
+                raise ValueError("Unsupported model file version: " + str(int(arrays["version"])))
+            activations = arrays["activations"].tolist()
+            weights = [arrays["W" + str(i)] for i in range(len(activations))]
+            biases = [arrays["b" + str(i)] for i in range(len(activations))]
+            scaler = None
+            if ("ftMin" in arrays):
+                scaler = utility.FeatureScaler(arrays["ftMin"], arrays["ftMax"],
+                            arrays["featureList"].tolist() or None)
+            return NumpyModel(weights, biases, activations, arrays["inputShape"], arrays["outputShape"], scaler)
+
+def fromKeras(model, scaler=None):
+    # Reads the layers of a keras model (no tensorflow import here). Raises ValueError for
+    # layers other than Flatten, Dense, Reshape & no-ops.
+    weights, biases, activations = [], [], []
+    outputShape = None
+    for layer in model.layers:
+        layerType = type(layer).__name__
+        if (layerType == "Dense"):
+            layerWeights = layer.get_weights()
+            weights.append(layerWeights[0])
+            biases.append(layerWeights[1] if len(layerWeights) > 1 else np.zeros(layerWeights[0].shape[1]))
+            activations.append(layer.get_config()["activation"])
+            outputShape = (layerWeights[0].shape[1],)
+        elif (layerType == "Reshape"):
+            outputShape = tuple(layer.get_config()["target_shape"])
+        elif ((layerType == "Flatten" and len(weights) == 0) or layerType in IDENTITY_LAYERS):
+            continue
+        else:
+            raise ValueError("Layer not supported by the NumPy runtime: " + layerType + " (" + layer.name + ")")
+    if (len(weights) == 0):
+        raise ValueError("No Dense layers in model: " + model.name)
+    return NumpyModel(weights, biases, activations, model.input_shape[1:], outputShape, scaler)
+
+def exportModel(model, scaler, fileName):
+    fromKeras(model, scaler).save(fileName)
+    return
+
+# Several models (eg. all sources of many regions) evaluated together: the weights of each
+# layer are stacked (zero-padded to the largest model), so each layer is one batched matrix
+# product over all models & days. Padded inputs & hidden units have zero weights into the
+# next layer, so they don't change the outputs. The models need the same activations.
+class ModelBatch:
+    def __init__(self, models):
+        self.models = list(models)
+        activations = self.models[0].activations
+        if (any(model.activations != activations for model in self.models)):
+            raise ValueError("Models of a batch need the same layers & activations")
+        self.activations = activations
+        self.weights, self.biases = [], []
+        for i in range(len(activations)):
+            numIn = max(model.weights[i].shape[0] for model in self.models)
+            numOut = max(model.weights[i].shape[1] for model in self.models)
+            weights = np.zeros((len(self.models), numIn, numOut), dtype=DTYPE)
+            biases = np.zeros((len(self.models), 1, numOut), dtype=DTYPE)
+            for k, model in enumerate(self.models):
+                w = model.weights[i]
+                weights[k, :w.shape[0], :w.shape[1]] = w
+                biases[k, 0, :w.shape[1]] = model.biases[i]
+            self.weights.append(weights)
+            self.biases.append(biases)
+
+    def predict(self, inputs):
+        # inputs: scaled inputs of each model (days x hours x features), returns the scaled
+        # outputs of each model (days x outputShape)
+        numDays = [len(X) for X in inputs]
+        out = np.zeros((len(self.models), max(numDays), self.weights[0].shape[1]), dtype=DTYPE)
+        for k, X in enumerate(inputs):
+            X = np.asarray(X, dtype=DTYPE).reshape(numDays[k], -1)
+            out[k, :numDays[k], :X.shape[1]] = X
+        for weights, biases, activation in zip(self.weights, self.biases, self.activations):
+            out = ACTIVATIONS[activation](np.matmul(out, weights) + biases)
+        outputs = []
+        for k, model in enumerate(self.models):
+            numOutputs = int(np.prod(model.outputShape))
+            outputs.append(out[k, :numDays[k], :numOutputs].reshape((numDays[k],) + model.outputShape))
+        return outputs
+
+    def forecast(self, featureRows):
+        # featureRows: unscaled features of each model (days x hours x features), returns
+        # the production forecasts of each model (days x hours [x sources])
+        inputs = [model.scaler.transform(rows) for model, rows in zip(self.models, featureRows)]
+        outputs = self.predict(inputs)
+        return [model.scaler.inverseTransform(output.astype(np.float64), model.getOutputCols())
+                for model, output in zip(self.models, outputs)]
+
+def exportRegistry(registry, region=None, source=None):
+    # writes the NumPy model file of registered models that don't have one yet
+    numExported = 0
+    for meta in registry.listEntries(region, source):
+        key = (meta["region"], meta["source"], meta["period"], meta["experiment"])
+        if (registry.hasNumpyModel(*key)):
+            continue
+        model, scaler, _ = registry.load(*key)
+        exportModel(model, scaler, registry.getNumpyModelFileName(*key))
+        print("Exported ", registry.getNumpyModelFileName(*key))
+        numExported += 1
+    return numExported
+
+def verifyRegistry(registry, region=None, source=None, numDays=NUM_VERIFY_DAYS, tolerance=TOLERANCE):
+    # Compares the NumPy runtime with keras on random (scaled) inputs for each registered
+    # model & times both. Returns the max. abs. difference of each model.
+    rng = np.random.default_rng(0)
+    results, models, inputs = {}, [], []
+    kerasTime, numpyTime = 0.0, 0.0
+    for meta in registry.listEntries(region, source):
+        key = (meta["region"], meta["source"], meta["period"], meta["experiment"])
+        kerasModel, _, _ = registry.load(*key)
+        numpyModel, _, _ = registry.loadNumpy(*key)
+        X = rng.random((numDays,) + numpyModel.inputShape)
+        startTime = time.perf_counter()
+        expected = kerasModel.predict(X.astype(np.float32), batch_size=numDays, verbose=0)
+        kerasTime += time.perf_counter() - startTime
+        startTime = time.perf_counter()
+        predicted = numpyModel.predict(X)
+        numpyTime += time.perf_counter() - startTime
+        results[key] = float(np.max(np.abs(predicted - expected.reshape(predicted.shape))))
+        print(" ".join(str(value) for value in key), ", max abs. difference: ", results[key],
+                "" if results[key] <= tolerance else " <-- over the tolerance (" + str(tolerance) + ")")
+        models.append(numpyModel)
+        inputs.append(X)
+    print("Inference of ", len(results), " models x ", numDays, " days, keras: ", round(kerasTime * 1000, 1),
+            " ms, NumPy: ", round(numpyTime * 1000, 1), " ms")
+    if (len(models) > 1):
+        try:
+            batch = ModelBatch(models)
+        except ValueError as e:
+            print("Not batched: ", e)
+            return results
+        startTime = time.perf_counter()
+        outputs = batch.predict(inputs)
+        batchTime = time.perf_counter() - startTime
+        difference = max(float(np.max(np.abs(output - model.predict(X))))
+                            for output, model, X in zip(outputs, models, inputs))
+        print("NumPy, all models in one batch: ", round(batchTime * 1000, 1),
+                " ms, max abs. difference from single models: ", difference)
+    return results
+
+
+if __name__ == "__main__":
+    if (len(sys.argv) < 2 or len(sys.argv) > 4 or sys.argv[1] not in ["export", "verify"]):
+        print("Usage: python3 numpyModel.py <export/verify> [region] [source]")
+        print("export - writes the NumPy model file of registered models (trained before it was written)")
+        print("verify - compares the outputs & run times of the NumPy runtime & keras")
+        exit(0)
+    import modelRegistry
+    registry = modelRegistry.ModelRegistry()
+    region = sys.argv[2] if len(sys.argv) > 2 else None
+    source = sys.argv[3] if len(sys.argv) > 3 else None
+    if (sys.argv[1] == "export"):
+        print("Exported ", exportRegistry(registry, region, source), " models")
+    else:
+        results = verifyRegistry(registry, region, source)
+        if (any(difference > TOLERANCE for difference in results.values())):
+            exit(1)
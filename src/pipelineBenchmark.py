@@ -0,0 +1,273 @@
+import contextlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from keras.layers import Dense, Flatten
+from keras.models import Sequential
+
+import carbonIntensityCalculator
+import sourceProductionForecast
+import utility
+
+############################# MACRO START #######################################
+YEARS = [1, 5, 10] # length of the synthetic datasets
+NUM_SOURCES = [4, 11] # no. of sources in the synthetic datasets
+NUM_RUNS = 3 # timings are the median of NUM_RUNS runs
+START_DATE = "2019-01-01 00:00:00"
+SOURCES = ["coal", "nat_gas", "nuclear", "oil", "hydro", "solar", "wind", "unknown",
+           "geothermal", "biomass", "other"] # keys of carbonIntensityCalculator.carbonRateDirect
+WEATHER_COLUMNS = ["forecast_avg_wind_speed_wMean", "forecast_avg_temperature_wMean",
+                   "forecast_avg_dewpoint_wMean", "forecast_avg_dswrf_wMean",
+                   "forecast_avg_precipitation_wMean"]
+MISSING_HOUR_FRACTION = 0.005 # hours with no source data (filled by the calculator)
+NUM_TEST_DAYS = 184
+NUM_VAL_DAYS = sourceProductionForecast.NUM_VAL_DAYS
+WINDOW_HOURS = sourceProductionForecast.TRAINING_WINDOW_HOURS
+HIDDEN = [20, 50] # layer sizes of the (untrained) forecast model, as in getANNHyperParams
+RANDOM_SEED = 0
+RESULTS_DIR = "../data/benchmarks/"
+REGRESSION_THRESHOLD = 1.1 # compare: flag stages that got more than 10% slower
+STAGES = ["calculateCarbonIntensity", "addDateTimeFeatures", "scaleDataset",
+          "manipulateTrainingDataShape", "getDayAheadForecasts", "getMape"]
+############################# MACRO END #########################################
+
+# Times the main stages of DACF on synthetic hourly data shaped like the data/<ISO> files:
+# the carbon intensity calculation on the fuel mix and the feature engineering, scaling,
+# windowing, day-ahead inference & evaluation of the source forecasts (on the last
+# source, with the weather forecasts as extra features, as for solar/wind). The forecast
+# model is untrained, only its inference cost is measured (training is not benchmarked).
+# For each stage: median wall time, throughput (input rows/s) & peak memory allocated by
+# the stage (tracemalloc, in a separate run; numpy & pandas allocations are traced, the
+# memory used inside tensorflow is not). Results are saved as JSON, "compare" shows the
+# change between two result files.
+
+def getSyntheticData(years, numSources, seed=RANDOM_SEED):
+    # hourly fuel mix & weather forecasts: "UTC time", <sources>, <weather columns>
+    if (numSources < 1 or numSources > len(SOURCES)):
+        raise ValueError("No. of sources must be 1-" + str(len(SOURCES)))
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(START_DATE, periods=int(round(years * 365.25)) * 24, freq="H")
+    numHours = len(dates)
+    hourOfDay = dates.hour.to_numpy()
+    dayOfYear = dates.dayofyear.to_numpy()
+    daily = np.sin((hourOfDay - 6) * (2 * np.pi / 24))
+    seasonal = np.sin((dayOfYear - 80) * (2 * np.pi / 365.25))
+    dataset = pd.DataFrame({"UTC time": dates})
+    for i in range(numSources):
+        base = rng.uniform(500, 5000)
+        values = base * (1 + 0.3 * rng.uniform(0.2, 1) * daily + 0.2 * seasonal)
+        values += rng.normal(0, 0.05 * base, numHours)
+        if (SOURCES[i] == "solar"):
+            values = np.maximum(daily, 0) * base * (1 + 0.3 * seasonal)
+        dataset[SOURCES[i]] = np.round(np.maximum(values, 0))
+    missingHours = rng.random(numHours) < MISSING_HOUR_FRACTION
+    dataset.loc[missingHours, SOURCES[:numSources]] = 0
+    for i in range(len(WEATHER_COLUMNS)):
+        dataset[WEATHER_COLUMNS[i]] = (rng.uniform(1, 300) * (1 + 0.1 * daily + 0.2 * seasonal) +
+                                        rng.normal(0, 1, numHours))
+    return dataset
+
+def getForecastModel(numFeatures):
+    model = Sequential()
+    model.add(Flatten())
+    model.add(Dense(HIDDEN[0], activation="relu"))
+    model.add(Dense(HIDDEN[1], activation="relu"))
+    model.add(Dense(WINDOW_HOURS))
+    model.build((None, WINDOW_HOURS, numFeatures))
+    return model
+
+class StageTimer:
+    # Collects the wall time & (if traceMemory) the peak traced memory of each stage
+    def __init__(self, traceMemory=False):
+        self.traceMemory = traceMemory
+        self.times = {}
+        self.peakMemory = {}
+        self.maxTracedMemory = 0 # highest traced memory seen, in & between stages
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if (self.traceMemory is True):
+            self.maxTracedMemory = max(self.maxTracedMemory, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            startMemory = tracemalloc.get_traced_memory()[0]
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = time.perf_counter() - startTime
+            if (self.traceMemory is True):
+                peakMemory = tracemalloc.get_traced_memory()[1]
+                self.maxTracedMemory = max(self.maxTracedMemory, peakMemory)
+                self.peakMemory[name] = peakMemory - startMemory
+
+def runPipeline(data, model, timer):
+    # the stages chained as in carbonIntensityCalculator.py & sourceProductionForecast.py
+    numSources = len([col for col in data.columns if col in SOURCES])
+    rows = {}
+    dataset = data.copy()
+    rows["calculateCarbonIntensity"] = len(dataset)
+    with timer.stage("calculateCarbonIntensity"):
+        dataset = carbonIntensityCalculator.calculateCarbonIntensity(dataset,
+                    carbonIntensityCalculator.carbonRateDirect, numSources)
+
+    # forecasts of the last source, features: source, date time features & weather forecasts
+    dataset = dataset.set_index("UTC time")
+    sourceCol = dataset.columns.get_loc(SOURCES[numSources-1])
+    dateTime = dataset.index.values
+    rows["addDateTimeFeatures"] = len(dataset)
+    with timer.stage("addDateTimeFeatures"):
+        dataset = utility.addDateTimeFeatures(dataset, dateTime, sourceCol)
+    numFeatures = len(dataset.columns) - sourceCol
+    trainData, valData, testData, _ = utility.splitDataset(dataset.values, NUM_TEST_DAYS, NUM_VAL_DAYS)
+    trainData = trainData[:, sourceCol:].astype(np.float64)
+    valData = valData[:, sourceCol:].astype(np.float64)
+    testData = testData[:, sourceCol:].astype(np.float64)
+    testDates = dateTime[-NUM_TEST_DAYS*24:]
+
+    rows["scaleDataset"] = len(trainData) + len(valData) + len(testData)
+    with timer.stage("scaleDataset"):
+        trainData, valData, testData, ftMin, ftMax = utility.scaleDataset(trainData, valData, testData)
+
+    rows["manipulateTrainingDataShape"] = len(trainData)
+    with timer.stage("manipulateTrainingDataShape"):
+        X, y = sourceProductionForecast.manipulateTrainingDataShape(trainData, WINDOW_HOURS, WINDOW_HOURS)
+
+    history = valData[-WINDOW_HOURS:, :].tolist()
+    rows["getDayAheadForecasts"] = len(testData)
+    with timer.stage("getDayAheadForecasts"):
+        predictedData = sourceProductionForecast.getDayAheadForecasts(X, y, model, history, testData,
+                            WINDOW_HOURS, numFeatures, 0)
+
+    actual = utility.inverseDataScaling(testData[:len(predictedData)*24, 0], ftMax[0], ftMin[0])
+    forecast = utility.inverseDataScaling(predictedData.reshape(-1), ftMax[0], ftMin[0])
+    rows["getMape"] = len(actual)
+    with timer.stage("getMape"):
+        utility.getMape(testDates, actual, forecast)
+    return rows
+
+def benchmarkConfig(years, numSources, numRuns=NUM_RUNS):
+    data = getSyntheticData(years, numSources)
+    numFeatures = 1 + 5 + len(WEATHER_COLUMNS) # source, date time features & weather
+    model = getForecastModel(numFeatures)
+    stageTimes = {stage: [] for stage in STAGES}
+    totalTimes = []
+    with open(os.devnull, "w") as devNull, contextlib.redirect_stdout(devNull):
+        model.predict(np.zeros((1, WINDOW_HOURS, numFeatures)), verbose=0) # builds the predict function
+        for i in range(numRuns):
+            timer = StageTimer()
+            startTime = time.perf_counter()
+            rows = runPipeline(data, model, timer)
+            totalTimes.append(time.perf_counter() - startTime)
+            for stage in STAGES:
+                stageTimes[stage].append(timer.times[stage])
+        timer = StageTimer(traceMemory=True)
+        tracemalloc.start()
+        try:
+            startMemory = tracemalloc.get_traced_memory()[0]
+            runPipeline(data, model, timer)
+            timer.maxTracedMemory = max(timer.maxTracedMemory, tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+
+    result = {"years": years, "numSources": numSources, "numRows": len(data), "stages": {}}
+    for stage in STAGES:
+        stageTime = float(np.median(stageTimes[stage]))
+        result["stages"][stage] = {"timeSec": stageTime, "rows": rows[stage],
+            "rowsPerSec": rows[stage] / stageTime if stageTime > 0 else None,
+            "peakMemoryMB": timer.peakMemory[stage] / 2**20}
+    totalTime = float(np.median(totalTimes))
+    result["endToEnd"] = {"timeSec": totalTime, "rows": len(data), "rowsPerSec": len(data) / totalTime,
+                            "peakMemoryMB": (timer.maxTracedMemory - startMemory) / 2**20}
+    return result
+
+def getEnvironment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                    text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    import tensorflow as tf
+    return {"commit": commit, "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+            "tensorflow": tf.__version__, "platform": platform.platform(), "cpus": os.cpu_count()}
+
+def printResult(result):
+    print("Years: ", result["years"], ", sources: ", result["numSources"], ", rows: ", result["numRows"])
+    for stage, stats in list(result["stages"].items()) + [("end to end", result["endToEnd"])]:
+        print("   ", stage.ljust(28), str(round(stats["timeSec"] * 1000, 1)).rjust(9), "ms",
+                str(int(stats["rowsPerSec"] or 0)).rjust(12), "rows/s",
+                str(round(stats["peakMemoryMB"], 1)).rjust(8), "MB")
+    return
+
+def runBenchmark(yearsList=YEARS, numSourcesList=NUM_SOURCES, numRuns=NUM_RUNS, outFileName=None):
+    results = {"environment": getEnvironment(), "numRuns": numRuns, "configs": []}
+    for years in yearsList:
+        for numSources in numSourcesList:
+            result = benchmarkConfig(years, numSources, numRuns)
+            printResult(result)
+            results["configs"].append(result)
+    results["peakRssMB"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print("Peak RSS: ", round(results["peakRssMB"], 1), "MB")
+    if (outFileName is None):
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        outFileName = RESULTS_DIR + "pipeline_" + (results["environment"]["commit"] or "nocommit") + \
+                        "_" + time.strftime("%Y%m%d_%H%M%S") + ".json"
+    with open(outFileName, "w") as f:
+        json.dump(results, f, indent=2)
+    print("Results written to ", outFileName)
+    return results
+
+def compareResults(oldFileName, newFileName, threshold=REGRESSION_THRESHOLD):
+    # prints new/old time of each stage of the configs in both files; returns the regressions
+    with open(oldFileName) as f:
+        old = json.load(f)
+    with open(newFileName) as f:
+        new = json.load(f)
+    oldConfigs = {(config["years"], config["numSources"]): config for config in old["configs"]}
+    print("Old: ", old["environment"]["commit"], old["environment"]["time"],
+            ", new: ", new["environment"]["commit"], new["environment"]["time"])
+    regressions = []
+    for config in new["configs"]:
+        key = (config["years"], config["numSources"])
+        if (key not in oldConfigs):
+            continue
+        print("Years: ", key[0], ", sources: ", key[1])
+        oldStages = dict(oldConfigs[key]["stages"], **{"end to end": oldConfigs[key]["endToEnd"]})
+        for stage, stats in list(config["stages"].items()) + [("end to end", config["endToEnd"])]:
+            if (stage not in oldStages):
+                continue
+            ratio = stats["timeSec"] / oldStages[stage]["timeSec"]
+            isRegression = ratio > threshold
+            if (isRegression is True):
+                regressions.append((key, stage, ratio))
+            print("   ", stage.ljust(28), str(round(oldStages[stage]["timeSec"] * 1000, 1)).rjust(9), "ms ->",
+                    str(round(stats["timeSec"] * 1000, 1)).rjust(9), "ms (x", round(ratio, 2), ")",
+                    " <-- slower" if isRegression is True else "")
+    return regressions
+
+
+if __name__ == "__main__":
+    if (len(sys.argv) < 2 or sys.argv[1] not in ["run", "compare"] or
+            (sys.argv[1] == "compare" and len(sys.argv) != 4) or len(sys.argv) > 6):
+        print("Usage: python3 pipelineBenchmark.py run [years] [num_sources] [num_runs] [out_file.json]")
+        print("       python3 pipelineBenchmark.py compare <old.json> <new.json>")
+        print("years, num_sources - comma separated lists (default: "
+                + ",".join(map(str, YEARS)) + " & " + ",".join(map(str, NUM_SOURCES)) + ")")
+        print("Example: python3 pipelineBenchmark.py run 1,10 4,11 5")
+        exit(0)
+    if (sys.argv[1] == "compare"):
+        regressions = compareResults(sys.argv[2], sys.argv[3])
+        exit(1 if len(regressions) > 0 else 0)
+    yearsList = [float(x) for x in sys.argv[2].split(",")] if len(sys.argv) > 2 else YEARS
+    numSourcesList = [int(x) for x in sys.argv[3].split(",")] if len(sys.argv) > 3 else NUM_SOURCES
+    numRuns = int(sys.argv[4]) if len(sys.argv) > 4 else NUM_RUNS
+    outFileName = sys.argv[5] if len(sys.argv) > 5 else None
+    runBenchmark(yearsList, numSourcesList, numRuns, outFileName)
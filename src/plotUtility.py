@@ -0,0 +1,77 @@
+import matplotlib.dates as mdates
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from statsmodels.tsa.stattools import adfuller
+
+import utility
+
+# Plotting & time series analysis helpers of utility (imported on first use, see
+# utility.LAZY_FUNCTIONS)
+
+def showPlots():
+    plt.show()
+
+def analyzeTimeSeries(dataset, trainData, unscaledCarbonIntensity, dateTime):
+    global NUM_FEATURES
+    global LOCAL_TIMEZONE
+    global START_COL
+    # checkStationarity(dataset)
+    # showTrends(dataset, dateTime, LOCAL_TIMEZONE)
+    print("Plotting each feature distribution...")
+    features = dataset.columns.values[START_COL:START_COL+NUM_FEATURES]
+    trainDataFrame = pd.DataFrame(unscaledCarbonIntensity, columns=features)
+    createFeatureViolinGraph(features, trainDataFrame, dateTime)
+    print("***** Feature distribution plotting done *****")
+    return
+
+def checkStationarity(dataset):
+    print(dataset.columns)
+    carbon = dataset["carbon_intensity"].values
+    print(len(carbon))
+    result = adfuller(carbon, autolag='AIC')
+    print(f'ADF Statistic: {result[0]}')
+    print(f'n_lags: {result[1]}')
+    print(f'p-value: {result[1]}')
+    for key, value in result[4].items():
+        print('Critial Values:')
+        print(f'   {key}, {value}')
+    return
+
+def showTrends(dataset, dateTime, localTimeZone):
+    global MONTH_INTERVAL
+    carbon = np.array(dataset["carbon_intensity"].values)
+    carbon = np.resize(carbon, (carbon.shape[0]//24, 24))
+    dailyAvgCarbon = np.mean(carbon, axis = 1)
+    dates = utility.getDatesInLocalTimeZone(dateTime)    
+    
+    fig, ax = plt.subplots()
+    ax.plot(dates, dailyAvgCarbon)
+    # ax.xaxis.set_major_formatter(mdates.DateFormatter("%m-%d, %H:%M"))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter("%m-%d"))
+    ax.xaxis.set_major_locator(mdates.MonthLocator(interval=MONTH_INTERVAL, tz=localTimeZone))
+    
+    plt.xlabel("Local time")
+    plt.ylabel("Carbon Intensity (g/kWh)")
+    # plt.title("Carbon Intensity Trend")
+    plt.grid(axis="x")
+    plt.xticks(rotation=90)
+
+    plt.legend()
+    # plt.show()
+    return
+
+def createFeatureViolinGraph(features, dataset, dateTime):
+    # print(features)
+    # print(dataset)
+    dataset = dataset.astype(np.float64)
+    plt.figure() #figsize=(12, 6)
+    datasetMod = dataset.melt(var_name='Column', value_name='Normalized values')
+    ax = sns.violinplot(x='Column', y='Normalized values', data=datasetMod, scale="count")
+    # ax = plt.boxplot(dataset, vert=True)
+    # for ft in features:
+    #     print(ft, np.amax(dataset[ft].values), np.amin(dataset[ft].values))
+    _ = ax.set_xticklabels(features, rotation=80)
+    plt.show()
+    return
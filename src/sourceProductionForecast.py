@@ -1,13 +1,18 @@
 import csv
+import json
 import math
+import os
+import shutil
 import sys
+import tempfile
+import time
 from datetime import datetime as dt
 from datetime import timezone as tz
 
 import numpy as np
 import pandas as pd
 import pytz as pytz
-from keras.layers import Dense, Flatten
+from keras.layers import Dense, Flatten, Reshape
 from keras.models import Sequential
 from scipy.sparse import data
 from sklearn.utils import validation
@@ -17,6 +22,9 @@ from keras.callbacks import EarlyStopping
 from keras.callbacks import ModelCheckpoint
 from keras.models import load_model
 
+import columnarStore
+import instrumentation
+import modelRegistry
 import utility
 
 ############################# MACRO START #######################################
@@ -40,6 +48,8 @@ SOURCE_COL = None
 
 NUM_VAL_DAYS = 30
 NUM_TEST_DAYS = 184
+PERIOD_START = "2019-01-01 00:00:00" # the periods end DATASET_LIMITER hours after this time
+MIN_TRAIN_DAYS = 30 # periods with less training data (before the validation days) are skipped
 TRAINING_WINDOW_HOURS = 24
 PREDICTION_WINDOW_HOURS = 24
 MODEL_SLIDING_WINDOW_LEN = 24
@@ -51,84 +61,162 @@ NUM_FEATURES_DICT = {"coal":6, "nat_gas":6, "nuclear":6, "oil":6, "hydro":11, "s
                     "wind":11, "unknown": 6, "biomass": 6, "geothermal":6}
 
 NUM_FEATURES = 6
+
+MODEL_REGISTRY_DIR = modelRegistry.REGISTRY_DIR # trained models, see modelRegistry.py
+SKIP_UNCHANGED_MODELS = False # reuse registered models trained on the same data & hyperparameters
+
+WARM_START = False # initialize each period's model with the previous period's weights
+WARM_START_EPOCHS = 20 # max. epochs when fine-tuning a warm-started model
+COMPARE_COLD_START = False # with WARM_START, also train from scratch & report both
+
+USE_BEST_HYPERPARAMS = True # use the best configs found by hyperparameterSearch.py, if any
+BEST_HYPERPARAMS_FILE = "../data/best_hyperparams.json"
+
+USE_TF_DATA = True # train on windows generated by a tf.data pipeline (see utility.getWindowDataset)
+
+GAP_FILL_METHOD = "ffill" # "ffill" or "interpolate", see utility.fillGaps
+GAP_FILL_MAX_GAP = None # longest gap (hours) to fill, None: no limit
+
+USE_DATASET_CACHE = True # keep feature-engineered datasets in <data dir>/.cache/
+DATASET_CACHE_VERSION = 1 # bump when initDataset/addDateTimeFeatures output changes
+USE_COLUMNAR_STORE = True # read <file>.cols/ instead of the csv if it is up to date (see columnarStore.py)
 ############################# MACRO END #########################################
 
+# sourceCol: column no. or name of the source (the columnar store has no index & 
+# local time columns, so the column no. of a source differs from the csv's)
 def initDataset(inFileName, sourceCol):
-    dataset = pd.read_csv(inFileName, header=0, infer_datetime_format=True, 
-                            parse_dates=['UTC time'], index_col=['UTC time'])
-
-    print(dataset.head())
-    print(dataset.columns)
+    isColumnar = USE_COLUMNAR_STORE is True and columnarStore.isStoreUpToDate(inFileName)
+    with instrumentation.span("load", file=os.path.basename(inFileName)):
+        if (isColumnar is True):
+            dataset = columnarStore.readStore(columnarStore.getStoreDir(inFileName))
+        else:
+            dataset = pd.read_csv(inFileName, header=0, infer_datetime_format=True, 
+                                    parse_dates=['UTC time'], index_col=['UTC time'])
+    if (isinstance(sourceCol, str)):
+        sourceCol = dataset.columns.get_loc(sourceCol)
+
+    instrumentation.log(dataset.head())
+    instrumentation.log(dataset.columns)
     dateTime = dataset.index.values
     
     print("\nAdding features related to date & time...")
-    modifiedDataset = utility.addDateTimeFeatures(dataset, dateTime, sourceCol)
-    dataset = modifiedDataset
-    print("Features related to date & time added")
+    with instrumentation.span("feature engineering"):
+        modifiedDataset = utility.addDateTimeFeatures(dataset, dateTime, sourceCol)
+        dataset = modifiedDataset
     
-    for i in range(sourceCol, len(dataset.columns.values)):
-        col = dataset.columns.values[i]
-        dataset[col] = dataset[col].astype(np.float64)
-        # print(col, dataset[col].dtype)
+        # float64 for the csv & the columnar store alike (the store's float32 columns are copied)
+        for i in range(sourceCol, len(dataset.columns.values)):
+            col = dataset.columns.values[i]
+            dataset[col] = dataset[col].astype(np.float64)
+            # print(col, dataset[col].dtype)
+    print("Features related to date & time added")
+
+    return dataset, dateTime
 
+def loadDataset(inFileName, sourceCol):
+    # initDataset, backed by an on-disk cache keyed on the csv file's mtime & size
+    # (not needed for the columnar store, which is as fast to read)
+    isColumnar = USE_COLUMNAR_STORE is True and columnarStore.isStoreUpToDate(inFileName)
+    if (USE_DATASET_CACHE is False or isColumnar is True):
+        return initDataset(inFileName, sourceCol)
+    cacheFileName = os.path.join(os.path.dirname(inFileName), ".cache", 
+                        os.path.basename(inFileName) + ".pkl")
+    fileStat = os.stat(inFileName)
+    cacheKey = (DATASET_CACHE_VERSION, fileStat.st_mtime_ns, fileStat.st_size, sourceCol)
+    with instrumentation.span("load", file=os.path.basename(cacheFileName)):
+        cached = utility.readCache(cacheFileName, cacheKey)
+    if (cached is not None):
+        print("Loaded cached dataset: ", cacheFileName)
+        return cached
+    dataset, dateTime = initDataset(inFileName, sourceCol)
+    with instrumentation.span("write", file=os.path.basename(cacheFileName)):
+        utility.writeCache(cacheFileName, cacheKey, (dataset, dateTime))
     return dataset, dateTime
 
 # convert training data into inputs and outputs (labels)
-def manipulateTrainingDataShape(data, trainWindowHours, labelWindowHours): 
-    print("Data shape: ", data.shape)
-    X, y = list(), list()
+# numLabelCols: labels of the first numLabelCols columns (joint model, see jointForecast.py)
+def manipulateTrainingDataShape(data, trainWindowHours, labelWindowHours, numLabelCols=None): 
+    instrumentation.log("Data shape: ", data.shape)
     # step over the entire history one time step at a time
-    for i in range(len(data)-(trainWindowHours+labelWindowHours)+1):
-        # define the end of the input sequence
-        trainWindow = i + trainWindowHours
-        labelWindow = trainWindow + labelWindowHours
-        xInput = data[i:trainWindow, :]
-        # xInput = xInput.reshape((len(xInput), 1))
-        X.append(xInput)
-        y.append(data[trainWindow:labelWindow, 0])
-        # print(data[trainWindow:labelWindow, 0])
-    return np.array(X, dtype=np.float64), np.array(y, dtype=np.float64)
+    X, y = utility.getTrainingWindows(data, trainWindowHours, labelWindowHours, numLabelCols)
+    # Keras needs contiguous float arrays, so this is where the windows get copied
+    return np.ascontiguousarray(X, dtype=np.float64), np.ascontiguousarray(y, dtype=np.float64)
 
 def manipulateTestDataShape(data, slidingWindowLen, predictionWindowHours, isDates=False): 
-    X = list()
-    # step over the entire history one time step at a time
-    for i in range(0, len(data)-(predictionWindowHours)+1, slidingWindowLen):
-        # define the end of the input sequence
-        predictionWindow = i + predictionWindowHours
-        X.append(data[i:predictionWindow])
+    # step over the entire history one sliding window at a time
+    X = utility.getTestWindows(data, slidingWindowLen, predictionWindowHours)
     if (isDates is False):
-        X = np.array(X, dtype=np.float64)
+        X = np.ascontiguousarray(X, dtype=np.float64)
     else:
-        X = np.array(X)
+        X = np.ascontiguousarray(X)
     return X
 
 
-def trainANN(trainX, trainY, valX, valY, hyperParams):
-    n_timesteps, n_features, nOutputs = trainX.shape[1], trainX.shape[2], trainY.shape[1]
-    epochs = 1 #hyperParams['epoch']
+# initModel: trained model whose weights the new model starts from (warm start). It is 
+# then fine-tuned for at most WARM_START_EPOCHS epochs.
+# With trainY/valY None, trainX & valX are the (scaled) training & validation series and
+# the windows are generated by a tf.data pipeline instead of being materialized.
+# callbacks: extra keras callbacks (eg. pruning of hyperparameter search trials)
+# numTargets: no. of columns forecast (the first ones), >1 for a joint model of several sources,
+# whose outputs are (hours, numTargets). Taken from trainY if it is given.
+def trainANN(trainX, trainY, valX, valY, hyperParams, initModel=None, callbacks=(), numTargets=1):
+    if (trainY is None):
+        n_timesteps, n_features, nOutputs = TRAINING_WINDOW_HOURS, trainX.shape[1], TRAINING_WINDOW_HOURS
+    else:
+        n_timesteps, n_features, nOutputs = trainX.shape[1], trainX.shape[2], trainY.shape[1]
+        numTargets = trainY.shape[2] if trainY.ndim == 3 else 1
+    epochs = hyperParams['epoch']
     batchSize = hyperParams['batchsize']
     activationFunc = hyperParams['actv']
     lossFunc = hyperParams['loss']
     optimizer = hyperParams['optim']
     hiddenDims = hyperParams['hidden']
     learningRates = hyperParams['lr']
-    model = Sequential()
-    model.add(Flatten())
-    model.add(Dense(hiddenDims[0], input_shape=(n_timesteps, n_features), activation=activationFunc)) # 20 for coal, nat_gas, nuclear
-    model.add(Dense(hiddenDims[1], activation='relu')) # 50 for coal, nat_gas, nuclear
-    model.add(Dense(nOutputs))
-
-    opt = tf.keras.optimizers.Adam(learning_rate = learningRates)
-    model.compile(loss=lossFunc, optimizer=optimizer[0],
+    if (initModel is None):
+        model = Sequential()
+        model.add(Flatten())
+        model.add(Dense(hiddenDims[0], input_shape=(n_timesteps, n_features), activation=activationFunc)) # 20 for coal, nat_gas, nuclear
+        model.add(Dense(hiddenDims[1], activation='relu')) # 50 for coal, nat_gas, nuclear
+        if (numTargets == 1):
+            model.add(Dense(nOutputs))
+        else:
+            model.add(Dense(nOutputs * numTargets))
+            model.add(Reshape((nOutputs, numTargets)))
+    else:
+        model = keras.models.clone_model(initModel)
+        model.set_weights(initModel.get_weights())
+        epochs = min(epochs, WARM_START_EPOCHS)
+
+    opt = tf.keras.optimizers.get({"class_name": optimizer[0], "config": {"learning_rate": learningRates}})
+    model.compile(loss=lossFunc, optimizer=opt,
                     metrics=['mean_absolute_error'])
-    es = EarlyStopping(monitor='val_loss', mode='min', verbose=1, patience=10)
-    mc = ModelCheckpoint('best_model_ann.h5', monitor='val_loss', mode='min', verbose=1, save_best_only=True)
+    # keras progress output: per epoch (2) & on improvements (1), none in quiet mode
+    fitVerbose, callbackVerbose = (0, 0) if (instrumentation.QUIET is True) else (2, 1)
+    es = EarlyStopping(monitor='val_loss', mode='min', verbose=callbackVerbose, patience=10)
+    # checkpoint file private to this training, the model is kept in the registry
+    checkpointDir = tempfile.mkdtemp(prefix="dacf_ann_")
+    checkpointFileName = os.path.join(checkpointDir, "best_model_ann.h5")
+    mc = ModelCheckpoint(checkpointFileName, monitor='val_loss', mode='min', verbose=callbackVerbose, 
+                            save_best_only=True)
     # fit network
-    hist = model.fit(trainX, trainY, epochs=epochs, batch_size=batchSize[0], verbose=2,
-                        validation_data=(valX, valY), callbacks=[es, mc])
-    model = load_model("best_model_ann.h5")
+    try:
+        if (trainY is None):
+            numLabelCols = numTargets if numTargets > 1 else None
+            trainDataset = utility.getWindowDataset(trainX, n_timesteps, nOutputs, batchSize[0], True,
+                                numLabelCols=numLabelCols)
+            valDataset = utility.getWindowDataset(valX, n_timesteps, nOutputs, batchSize[0],
+                                numLabelCols=numLabelCols)
+            hist = model.fit(trainDataset, epochs=epochs, verbose=fitVerbose, validation_data=valDataset,
+                                callbacks=[es, mc] + list(callbacks))
+        else:
+            hist = model.fit(trainX, trainY, epochs=epochs, batch_size=batchSize[0], verbose=fitVerbose,
+                                validation_data=(valX, valY), callbacks=[es, mc] + list(callbacks))
+        model = load_model(checkpointFileName)
+    finally:
+        shutil.rmtree(checkpointDir, ignore_errors=True)
     utility.showModelSummary(hist, model)
-    return model, n_features
+    valLoss = float(np.min(hist.history['val_loss']))
+    return model, n_features, valLoss
 
 def getDayAheadForecasts(trainX, trainY, model, history, testData, 
                             trainWindowHours, numFeatures, depVarColumn):
@@ -136,6 +224,9 @@ def getDayAheadForecasts(trainX, trainY, model, history, testData,
     global PREDICTION_WINDOW_HOURS
     # walk-forward validation over each day
     print("Testing...")
+    if (PREDICTION_WINDOW_HOURS <= 24):
+        return getBatchedDayAheadForecasts(model, history, testData, trainWindowHours)
+    # recursive forecasts: predictions beyond the first 24 hours feed on earlier ones
     predictions = list()
     for i in range(0, len(testData)//24):
         dayAheadPredictions = list()
@@ -161,6 +252,18 @@ def getDayAheadForecasts(trainX, trainY, model, history, testData,
     return predictedData
 
 
+def getBatchedDayAheadForecasts(model, history, testData, trainWindowHours):
+    global MODEL_SLIDING_WINDOW_LEN
+    # For 24h-ahead forecasts the input of every test day is only observed data
+    # (history + earlier test days), so all days are predicted in one call.
+    numDays = len(testData)//24
+    series = np.concatenate([np.asarray(history, dtype=np.float64)[-trainWindowHours:], 
+                np.asarray(testData, dtype=np.float64)])
+    series = series[:(numDays-1)*MODEL_SLIDING_WINDOW_LEN + trainWindowHours]
+    inputX = utility.getTestWindows(series, MODEL_SLIDING_WINDOW_LEN, trainWindowHours)
+    predictedData = model.predict(np.ascontiguousarray(inputX), verbose=0)
+    return np.asarray(predictedData, dtype=np.float64)[:, :24]
+
 def getForecasts(model, history, trainWindowHours, numFeatures):
     # flatten data
     data = np.array(history, dtype=np.float64)
@@ -174,7 +277,9 @@ def getForecasts(model, history, trainWindowHours, numFeatures):
     yhat = yhat[0]
     return yhat, input_x
 
-def getANNHyperParams():
+# Default hyperparameters, or the best ones found for the region, source & period by
+# hyperparameterSearch.py (if recorded & USE_BEST_HYPERPARAMS is set)
+def getANNHyperParams(ISO=None, source=None, period=None):
     hyperParams = {}
     hyperParams['epoch'] = 100 
     hyperParams['batchsize'] = [10] 
@@ -183,177 +288,277 @@ def getANNHyperParams():
     hyperParams['optim'] = ["adam"] #, "rmsprop"]
     hyperParams['lr'] = 1e-2 #, 1e-3
     hyperParams['hidden'] = [20, 50] #, [50, 50]]#, [20, 50]] #, [50, 50]]
+    if (USE_BEST_HYPERPARAMS is True and ISO is not None and period is not None and 
+            os.path.exists(BEST_HYPERPARAMS_FILE)):
+        with open(BEST_HYPERPARAMS_FILE) as f:
+            best = json.load(f)
+        periodName = getPeriodSettings(period)[1][1:]
+        if (periodName in best.get(ISO, {}).get(source, {})):
+            print("Using best hyperparameters (", periodName, ") from ", BEST_HYPERPARAMS_FILE)
+            hyperParams.update(best[ISO][source][periodName]["hyperParams"])
     return hyperParams
 
-def runProgram(ISO, source):
-    global NUCLEAR, COAL, SOLAR, WIND, NAT_GAS, GEOTHERMAL, HYDRO, UNKNOWN, BIOMASS, OIL
-
-    periodRMSE = []
-    bestRMSE = []
-    predictedData = None
-    
-    LOCAL_TIMEZONE = pytz.timezone(LOCAL_TIMEZONES[ISO])
+def getSourceColumns(ISO):
+    # column no. of each source in the region's files (the module defaults are not
+    # modified, so that jobs for different regions can run in the same process)
+    SOURCE_TO_SOURCE_COL_MAP = {"coal": COAL, "nat_gas" : NAT_GAS, "nuclear" : NUCLEAR,
+        "oil" : OIL, "hydro" : HYDRO, "solar" : SOLAR, "wind" : WIND, 
+        "geothermal" : GEOTHERMAL, "biomass" : BIOMASS, "unknown" : UNKNOWN}
     if ISO == "SE":
-        NUCLEAR = 3
-        UNKNOWN = 4
-        HYDRO = 6
+        SOURCE_TO_SOURCE_COL_MAP.update({"nuclear": 3, "unknown": 4, "hydro": 6})
         FUEL = {3:"nuclear", 4:"unknown", 5:"wind", 6:"hydro"} # SE
     elif ISO == "DE":
-        BIOMASS = 2
-        GEOTHERMAL = 5
-        HYDRO = 6
-        NUCLEAR = 7
-        OIL = 8
-        SOLAR = 9
-        WIND = 10
-        UNKNOWN = 11
+        SOURCE_TO_SOURCE_COL_MAP.update({"biomass": 2, "geothermal": 5, "hydro": 6, "nuclear": 7,
+            "oil": 8, "solar": 9, "wind": 10, "unknown": 11})
         FUEL = {2:"biomass", 3:"coal", 4:"nat_gas", 5:"geothermal", 6:"hydro", 7:"nuclear",
                     8:"oil", 9:"solar", 10:"wind", 11:"unknown"} # DE
     else:
         FUEL = {3:"coal", 4:"nat_gas", 5:"nuclear", 6:"oil", 7:"hydro", 8:"solar",
                     9:"wind", 10:"unknown"}
+    return FUEL, SOURCE_TO_SOURCE_COL_MAP
 
-
-    SOURCE_TO_SOURCE_COL_MAP = {"coal": COAL, "nat_gas" : NAT_GAS, "nuclear" : NUCLEAR,
-        "oil" : OIL, "hydro" : HYDRO, "solar" : SOLAR, "wind" : WIND, 
-        "geothermal" : GEOTHERMAL, "biomass" : BIOMASS}
+# Parses & feature-engineers the training file of a source once, each period is a slice of it.
+# Returns (dataset, dateTime, source column, no. of features, file name).
+def getSourceDataset(ISO, source):
+    FUEL, SOURCE_TO_SOURCE_COL_MAP = getSourceColumns(ISO)
     SOURCE_COL = SOURCE_TO_SOURCE_COL_MAP[source]
     NUM_FEATURES = NUM_FEATURES_DICT[FUEL[SOURCE_COL]]
     print("Source: ", source, ", source col: ", SOURCE_COL, ", no. features: ", NUM_FEATURES)
     IN_FILE_NAME = "../data/"+ISO+"/fuel_forecast/"+ISO+"_"+FUEL[SOURCE_COL]+"_2019_clean.csv"
-    OUT_FILE_NAME_PREFIX = "../data/"+ISO+"/fuel_forecast/"+ISO+"_src_prod_forecast"
-    
-    for period in range(4):
-
-        ########################################################################
-        #### Train - Jan - Dec 2019, Test - Jan - Jun 2020 ####
-        if (period == 0):
-            DATASET_LIMITER = 13128
-            OUT_FILE_SUFFIX = "_h1_2020"
-            NUM_TEST_DAYS = 182
-        #### Train - Jan 2019 - Jun 2020, Test - Jul - Dec 2020 ####
-        if (period == 1):
-            DATASET_LIMITER = 17544
-            OUT_FILE_SUFFIX = "_h2_2020"
-            NUM_TEST_DAYS = 184
-        #### Train - Jan 2020 - Dec 2020, Test - Jan - Jun 2021 ####
-        if (period == 2):
-            DATASET_LIMITER = 21888
-            OUT_FILE_SUFFIX = "_h1_2021"
-            NUM_TEST_DAYS = 181
-        #### Train - Jan 2020 - Jun 2021, Test - Jul - Dec 2021 ####
-        if (period == 3):
-            DATASET_LIMITER = 26304
-            OUT_FILE_SUFFIX = "_h2_2021"
-            NUM_TEST_DAYS = 184
-        ########################################################################
-        
-
-        print("Initializing...")
-        dataset, dateTime = initDataset(IN_FILE_NAME, SOURCE_COL)
-        print("***** Initialization done *****")
-
-        # split into train and test
-        print("Spliting dataset into train/test...")
-        trainData, valData, testData, fullTrainData = utility.splitDataset(dataset.values, NUM_TEST_DAYS, 
-                                                NUM_VAL_DAYS)
-        trainDates = dateTime[: -(NUM_TEST_DAYS*24)]
-        fullTrainDates = np.copy(trainDates)
-        trainDates, validationDates = trainDates[: -(NUM_VAL_DAYS*24)], trainDates[-(NUM_VAL_DAYS*24):]
-        testDates = dateTime[-(NUM_TEST_DAYS*24):]
-        trainData = trainData[:, SOURCE_COL: SOURCE_COL+NUM_FEATURES]
-        valData = valData[:, SOURCE_COL: SOURCE_COL+NUM_FEATURES]
-        testData = testData[:, SOURCE_COL: SOURCE_COL+NUM_FEATURES]
-
-        print("TrainData shape: ", trainData.shape) # (days x hour) x features
-        print("ValData shape: ", valData.shape) # (days x hour) x features
-        print("TestData shape: ", testData.shape) # (days x hour) x features
-        print("***** Dataset split done *****")
-
-        for i in range(trainData.shape[0]):
-            for j in range(trainData.shape[1]):
-                if(np.isnan(trainData[i, j])):
-                    trainData[i, j] = trainData[i-1, j]
-
-        for i in range(valData.shape[0]):
-            for j in range(valData.shape[1]):
-                if(np.isnan(valData[i, j])):
-                    valData[i, j] = valData[i-1, j]
-
-        for i in range(testData.shape[0]):
-            for j in range(testData.shape[1]):
-                if(np.isnan(testData[i, j])):
-                    testData[i, j] = testData[i-1, j]
-
-        featureList = dataset.columns.values[SOURCE_COL:SOURCE_COL+NUM_FEATURES]
-        print("Features: ", featureList)
-
-        print("Scaling data...")
-        # unscaledTestData = np.zeros(testData.shape[0])
-        # for i in range(testData.shape[0]):
-        #     unscaledTestData[i] = testData[i, 0]
-        trainData, valData, testData, ftMin, ftMax = utility.scaleDataset(trainData, valData, testData)
-        print("***** Data scaling done *****")
-        print(trainData.shape, valData.shape, testData.shape)
-
+    print("Initializing...")
+    fullDataset, fullDateTime = loadDataset(IN_FILE_NAME, FUEL[SOURCE_COL])
+    SOURCE_COL = fullDataset.columns.get_loc(FUEL[SOURCE_COL])
+    print("***** Initialization done *****")
+    return fullDataset, fullDateTime, SOURCE_COL, NUM_FEATURES, IN_FILE_NAME
+
+# dataset limiter (hours from PERIOD_START to the end of the period), output file suffix &
+# no. of test days of a period
+def getPeriodSettings(period):
+    ########################################################################
+    #### Train - Jan - Dec 2019, Test - Jan - Jun 2020 ####
+    if (period == 0):
+        DATASET_LIMITER = 13128
+        OUT_FILE_SUFFIX = "_h1_2020"
+        NUM_TEST_DAYS = 182
+    #### Train - Jan 2019 - Jun 2020, Test - Jul - Dec 2020 ####
+    if (period == 1):
+        DATASET_LIMITER = 17544
+        OUT_FILE_SUFFIX = "_h2_2020"
+        NUM_TEST_DAYS = 184
+    #### Train - Jan 2020 - Dec 2020, Test - Jan - Jun 2021 ####
+    if (period == 2):
+        DATASET_LIMITER = 21888
+        OUT_FILE_SUFFIX = "_h1_2021"
+        NUM_TEST_DAYS = 181
+    #### Train - Jan 2020 - Jun 2021, Test - Jul - Dec 2021 ####
+    if (period == 3):
+        DATASET_LIMITER = 26304
+        OUT_FILE_SUFFIX = "_h2_2021"
+        NUM_TEST_DAYS = 184
+    ########################################################################
+    return DATASET_LIMITER, OUT_FILE_SUFFIX, NUM_TEST_DAYS
+
+# No. of rows of the dataset up to the end of a period. The files of some sources start
+# later than PERIOD_START (eg. CISO hydro & nat_gas in 2020), so the period is cut at its end
+# time, not at DATASET_LIMITER rows. Returns None (with a message) if the data ends before
+# the period does or has less than MIN_TRAIN_DAYS training days.
+def getPeriodRows(dateTime, DATASET_LIMITER, NUM_TEST_DAYS):
+    periodEnd = pd.Timestamp(PERIOD_START) + pd.Timedelta(hours=DATASET_LIMITER)
+    numRows = int(np.searchsorted(dateTime, periodEnd.to_datetime64()))
+    if (numRows == 0 or dateTime[numRows-1] < (periodEnd - pd.Timedelta(hours=1)).to_datetime64()):
+        print("Skipping period ending ", periodEnd, ": the data ends at ", 
+                dateTime[-1] if len(dateTime) > 0 else None)
+        return None
+    numTrainDays = numRows // 24 - NUM_TEST_DAYS - NUM_VAL_DAYS
+    if (numTrainDays < MIN_TRAIN_DAYS):
+        print("Skipping period ending ", periodEnd, ": only ", max(numTrainDays, 0), " training days")
+        return None
+    return numRows
+
+# Train/validation/test split of a period (numRows: see getPeriodRows), with gaps filled & scaled by a scaler fit on the
+# training data. Returns (trainData, valData, testData, testDates, featureList, scaler).
+def getPeriodData(fullDataset, fullDateTime, SOURCE_COL, NUM_FEATURES, numRows, NUM_TEST_DAYS):
+    dataset = fullDataset.iloc[:numRows].copy()
+    dateTime = fullDateTime[:numRows]
+
+    # split into train and test
+    print("Spliting dataset into train/test...")
+    trainData, valData, testData, fullTrainData = utility.splitDataset(dataset.values, NUM_TEST_DAYS, 
+                                            NUM_VAL_DAYS)
+    trainDates = dateTime[: -(NUM_TEST_DAYS*24)]
+    fullTrainDates = np.copy(trainDates)
+    trainDates, validationDates = trainDates[: -(NUM_VAL_DAYS*24)], trainDates[-(NUM_VAL_DAYS*24):]
+    testDates = dateTime[-(NUM_TEST_DAYS*24):]
+    trainData = trainData[:, SOURCE_COL: SOURCE_COL+NUM_FEATURES]
+    valData = valData[:, SOURCE_COL: SOURCE_COL+NUM_FEATURES]
+    testData = testData[:, SOURCE_COL: SOURCE_COL+NUM_FEATURES]
+
+    instrumentation.log("TrainData shape: ", trainData.shape) # (days x hour) x features
+    instrumentation.log("ValData shape: ", valData.shape) # (days x hour) x features
+    instrumentation.log("TestData shape: ", testData.shape) # (days x hour) x features
+    print("***** Dataset split done *****")
+
+    with instrumentation.span("fill"):
+        trainData, numFilledTrain = utility.fillGaps(trainData, GAP_FILL_METHOD, GAP_FILL_MAX_GAP)
+        valData, numFilledVal = utility.fillGaps(valData, GAP_FILL_METHOD, GAP_FILL_MAX_GAP)
+        testData, numFilledTest = utility.fillGaps(testData, GAP_FILL_METHOD, GAP_FILL_MAX_GAP)
+    print("Missing values filled (train/val/test): ", numFilledTrain, numFilledVal, numFilledTest)
+
+    featureList = dataset.columns.values[SOURCE_COL:SOURCE_COL+NUM_FEATURES]
+    instrumentation.log("Features: ", featureList)
+
+    print("Scaling data...")
+    # unscaledTestData = np.zeros(testData.shape[0])
+    # for i in range(testData.shape[0]):
+    #     unscaledTestData[i] = testData[i, 0]
+    with instrumentation.span("scale"):
+        scaler = utility.FeatureScaler(featureList=featureList).fit(trainData)
+        trainData = scaler.transform(trainData)
+        valData = scaler.transform(valData)
+        testData = scaler.transform(testData)
+    print("***** Data scaling done *****")
+    instrumentation.log(trainData.shape, valData.shape, testData.shape)
+    return trainData, valData, testData, testDates, featureList, scaler
+
+# Trains & tests the ANN model of one source in one region for one period, on the dataset of
+# getSourceDataset (fileStat: of its file, for the model registry's data key). prevModels:
+# {experiment: model of the previous period}, for warm starts. Returns (period name, result,
+# {experiment: model of this period}), or (None, None, prevModels) if the period is skipped.
+def runPeriodForecast(ISO, source, period, fullDataset, fullDateTime, SOURCE_COL, NUM_FEATURES,
+                        fileStat, registry, prevModels, writeOutput=True):
+    DATASET_LIMITER, OUT_FILE_SUFFIX, NUM_TEST_DAYS = getPeriodSettings(period)
+    numRows = getPeriodRows(fullDateTime, DATASET_LIMITER, NUM_TEST_DAYS)
+    if (numRows is None):
+        return None, None, prevModels
 
+    OUT_FILE_NAME_PREFIX = "../data/"+ISO+"/fuel_forecast/"+ISO+"_src_prod_forecast"
+    models = {} # experiment: model of this period
+    bestRMSE, trainTimes, valLosses, coldTrainTimes, coldValLosses = [], [], [], [], []
+    trainData, valData, testData, testDates, featureList, scaler = getPeriodData(fullDataset, 
+        fullDateTime, SOURCE_COL, NUM_FEATURES, numRows, NUM_TEST_DAYS)
+    ftMin, ftMax = scaler.ftMin, scaler.ftMax
+
+    if (USE_TF_DATA is True):
+        # windows are generated while training
+        X, y, valX, valY = trainData, None, valData, None
+    else:
         print("\nManipulating training data...")
-        X, y = manipulateTrainingDataShape(trainData, TRAINING_WINDOW_HOURS, TRAINING_WINDOW_HOURS)
-        # Next line actually labels validation data
-        valX, valY = manipulateTrainingDataShape(valData, TRAINING_WINDOW_HOURS, TRAINING_WINDOW_HOURS)
+        with instrumentation.span("window"):
+            X, y = manipulateTrainingDataShape(trainData, TRAINING_WINDOW_HOURS, TRAINING_WINDOW_HOURS)
+            # Next line actually labels validation data
+            valX, valY = manipulateTrainingDataShape(valData, TRAINING_WINDOW_HOURS, TRAINING_WINDOW_HOURS)
         print("***** Training data manipulation done *****")
-        print("X.shape, y.shape: ", X.shape, y.shape)
-
-        ######################## START #####################
-        
-        hyperParams = getANNHyperParams()
-
-        for xx in range(NUMBER_OF_EXPERIMENTS):
-            OUT_FILE_NAME = OUT_FILE_NAME_PREFIX + "_" + featureList[0] + OUT_FILE_SUFFIX + "_expt_"+str(xx)+".csv"
-            print("\nStarting training (iteration ", str(xx), ")...")
-            bestModel, numFeatures = trainANN(X, y, valX, valY, hyperParams)
+        instrumentation.log("X.shape, y.shape: ", X.shape, y.shape)
+
+    ######################## START #####################
+
+    hyperParams = getANNHyperParams(ISO, source, period)
+    hyperParams['warm_start'] = WARM_START
+
+    for xx in range(NUMBER_OF_EXPERIMENTS):
+        OUT_FILE_NAME = OUT_FILE_NAME_PREFIX + "_" + featureList[0] + OUT_FILE_SUFFIX + "_expt_"+str(xx)+".csv"
+        dataKey = [fileStat.st_mtime_ns, fileStat.st_size, numRows, list(featureList)]
+        if (SKIP_UNCHANGED_MODELS is True and registry.isUpToDate(ISO, source, OUT_FILE_SUFFIX[1:], 
+                xx, dataKey, hyperParams)):
+            print("\nUsing registered model (data & hyperparameters unchanged)")
+            with instrumentation.span("load", file="model registry"):
+                bestModel, _, meta = registry.load(ISO, source, OUT_FILE_SUFFIX[1:], xx)
+            numFeatures = trainData.shape[1]
+            trainTimes.append(0.0)
+            valLosses.append(meta["valLoss"])
+        else:
+            initModel = prevModels.get(xx) if WARM_START is True else None
+            if (initModel is not None and COMPARE_COLD_START is True):
+                print("\nStarting cold start training (iteration ", str(xx), ")...")
+                startTime = time.time()
+                with instrumentation.span("fit", coldStart=True):
+                    _, _, coldValLoss = trainANN(X, y, valX, valY, hyperParams)
+                coldTrainTimes.append(time.time() - startTime)
+                coldValLosses.append(coldValLoss)
+            print("\nStarting training (iteration ", str(xx), ", warm start: ", 
+                    initModel is not None, ")...")
+            startTime = time.time()
+            with instrumentation.span("fit", warmStart=initModel is not None):
+                bestModel, numFeatures, valLoss = trainANN(X, y, valX, valY, hyperParams, initModel)
+            trainTimes.append(time.time() - startTime)
+            valLosses.append(valLoss)
             print("***** Training done *****")
-            history = valData[-TRAINING_WINDOW_HOURS:, :].tolist()
+            with instrumentation.span("write", file="model registry"):
+                registry.register(ISO, source, OUT_FILE_SUFFIX[1:], xx, bestModel, scaler, hyperParams, 
+                    valLoss, dataKey, {"warmStarted": initModel is not None, "trainTime": trainTimes[-1]})
+        models[xx] = bestModel
+        history = valData[-TRAINING_WINDOW_HOURS:, :].tolist()
+        with instrumentation.span("predict"):
             predictedData = getDayAheadForecasts(X, y, bestModel, history, testData, 
                             TRAINING_WINDOW_HOURS, numFeatures, 0)            
+        with instrumentation.span("window", data="test"):
             actualData = manipulateTestDataShape(testData[:, 0], 
                     MODEL_SLIDING_WINDOW_LEN, PREDICTION_WINDOW_HOURS, False)
             formattedTestDates = manipulateTestDataShape(testDates, 
                     MODEL_SLIDING_WINDOW_LEN, PREDICTION_WINDOW_HOURS, True)
             formattedTestDates = np.reshape(formattedTestDates, 
                     formattedTestDates.shape[0]*formattedTestDates.shape[1])
+        with instrumentation.span("inverse-scale"):
             actualData = actualData.astype(np.float64)
-            print("ActualData shape: ", actualData.shape)
+            instrumentation.log("ActualData shape: ", actualData.shape)
             actual = np.reshape(actualData, actualData.shape[0]*actualData.shape[1])
-            print("actual.shape: ", actual.shape)
+            instrumentation.log("actual.shape: ", actual.shape)
             unscaledTestData = utility.inverseDataScaling(actual, ftMax[0], 
                                 ftMin[0])
             predictedData = predictedData.astype(np.float64)
-            print("PredictedData shape: ", predictedData.shape)
+            instrumentation.log("PredictedData shape: ", predictedData.shape)
             predicted = np.reshape(predictedData, predictedData.shape[0]*predictedData.shape[1])
-            print("predicted.shape: ", predicted.shape)
+            instrumentation.log("predicted.shape: ", predicted.shape)
             unScaledPredictedData = utility.inverseDataScaling(predicted, 
                         ftMax[0], ftMin[0])
-            rmseScore, mapeScore = utility.getScores(actualData, predictedData, 
-                                        unscaledTestData, unScaledPredictedData)
-            print("***** Forecast done *****")
-            print("Overall RMSE score: ", rmseScore)
-            bestRMSE.append(rmseScore)
-
-            data = []
-            for i in range(len(unScaledPredictedData)):
-                row = []
-                row.append(str(formattedTestDates[i]))
-                row.append(str(unscaledTestData[i]))
-                row.append(str(unScaledPredictedData[i]))
-                data.append(row)
-            utility.writeOutFuelForecastFile(OUT_FILE_NAME, data, featureList[0])
-
-            
-        print("Average RMSE after ", NUMBER_OF_EXPERIMENTS, " expts: ", np.mean(bestRMSE))
-        print(bestRMSE)
-
-    periodRMSE.append(bestRMSE)
+        rmseScore, mapeScore = utility.getScores(actualData, predictedData, 
+                                    unscaledTestData, unScaledPredictedData)
+        print("***** Forecast done *****")
+        print("Overall RMSE score: ", rmseScore)
+        bestRMSE.append(rmseScore)
+
+        if (writeOutput is True):
+            with instrumentation.span("write", file=os.path.basename(OUT_FILE_NAME)):
+                data = []
+                for i in range(len(unScaledPredictedData)):
+                    row = []
+                    row.append(str(formattedTestDates[i]))
+                    row.append(str(unscaledTestData[i]))
+                    row.append(str(unScaledPredictedData[i]))
+                    data.append(row)
+                utility.writeOutFuelForecastFile(OUT_FILE_NAME, data, featureList[0])
+
+    print("Average RMSE after ", NUMBER_OF_EXPERIMENTS, " expts: ", np.mean(bestRMSE))
+    print(bestRMSE)
+    result = {"feature": featureList[0], "dates": formattedTestDates, 
+        "actual": unscaledTestData, "forecast": unScaledPredictedData, "rmse": bestRMSE,
+        "train_time": trainTimes, "val_loss": valLosses, "cold_train_time": coldTrainTimes,
+        "cold_val_loss": coldValLosses}
+    return OUT_FILE_SUFFIX[1:], result, models
+
+# Trains & tests the ANN model of one source in one region over the given periods (0-3,
+# periods with too little data are skipped, see getPeriodRows).
+# Returns {period: {"feature", "dates", "actual", "forecast", "rmse"}}, with the unscaled 
+# hourly actual & forecast values of the test days (of the last experiment) and the
+# RMSE of each experiment. Forecast files are written only if writeOutput is True.
+def runSourceForecastPeriods(ISO, source, periods=range(4), writeOutput=True):
+    periodResults = {}
+    
+    LOCAL_TIMEZONE = pytz.timezone(LOCAL_TIMEZONES[ISO])
+    registry = modelRegistry.ModelRegistry(MODEL_REGISTRY_DIR)
+
+    fullDataset, fullDateTime, SOURCE_COL, NUM_FEATURES, IN_FILE_NAME = getSourceDataset(ISO, source)
+    fileStat = os.stat(IN_FILE_NAME)
+    prevModels = {} # experiment: model of the previous period, for warm starts
+    
+    ######################## START #####################
+    for period in periods:
+        # the spans of the period's stages are nested in a "period" span
+        with instrumentation.span("period", period=period):
+            periodName, result, prevModels = runPeriodForecast(ISO, source, period, fullDataset,
+                fullDateTime, SOURCE_COL, NUM_FEATURES, fileStat, registry, prevModels, writeOutput)
+        if (result is not None):
+            periodResults[periodName] = result
     ######################## END #####################
 
     # actual = np.reshape(actualData, actualData.shape[0]*actualData.shape[1])
@@ -361,9 +566,34 @@ def runProgram(ISO, source):
     # unScaledPredictedData = inverseDataNormalization(predicted, ftMax[0], 
     #                         ftMin[0])
 
-    print("RMSE: ", periodRMSE)
+    print("RMSE: ", {period: result["rmse"] for period, result in periodResults.items()})
+    printTrainingSummary(periodResults)
+    return periodResults
+
+# runSourceForecastPeriods in a "source forecast" span (see instrumentation.py)
+def runSourceForecast(ISO, source, periods=range(4), writeOutput=True):
+    with instrumentation.span("source forecast", region=ISO, source=source):
+        return runSourceForecastPeriods(ISO, source, periods, writeOutput)
+
+def printTrainingSummary(periodResults):
+    # mean training time & validation loss over the experiments of each period (warm start
+    # numbers next to the cold start ones, if both were trained)
+    print("Period, train time (s), val loss, cold start train time (s), cold start val loss")
+    for period, result in periodResults.items():
+        row = [period, round(np.mean(result["train_time"]), 1), np.mean(result["val_loss"])]
+        if (len(result["cold_train_time"]) > 0):
+            row.extend([round(np.mean(result["cold_train_time"]), 1), np.mean(result["cold_val_loss"])])
+        else:
+            row.extend(["-", "-"])
+        print(", ".join([str(val) for val in row]))
     return
 
+# Returns {period: [RMSE of each experiment]}
+def runProgram(ISO, source):
+    periodResults = runSourceForecast(ISO, source)
+    periodRMSE = {period: result["rmse"] for period, result in periodResults.items()}
+    return periodRMSE
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,68 @@
+import json
+import subprocess
+import sys
+
+import numpy as np
+
+############################# MACRO START #######################################
+# Modules timed by the benchmark & the import time each should stay under (None: no limit)
+MODULES = {"carbonIntensityCalculator": 1.0, "forecastMetrics": 1.0, "carbonStore": 1.0,
+           "columnarStore": 1.0, "utility": 1.0, "modelRegistry": 1.0, "numpyModel": 1.0,
+           "forecastServer": 1.0, "sourceProductionForecast": None}
+# Packages that the lightweight modules should not load at import time
+HEAVY_MODULES = ["tensorflow", "keras", "matplotlib", "seaborn", "statsmodels", "sklearn", "scipy"]
+NUM_RUNS = 5
+############################# MACRO END #########################################
+
+# Measures the import time of each module in a fresh interpreter (so nothing is cached in
+# sys.modules), the peak memory & which heavy packages got loaded with it. Exits with 1
+# if a module is over its time limit or loads a heavy package, so it can be used as a
+# check after changes to the imports.
+
+IMPORT_SCRIPT = """
+import json, resource, sys, time
+startTime = time.perf_counter()
+import {module}
+importTime = time.perf_counter() - startTime
+heavy = sorted(set(name.split(".")[0] for name in sys.modules) & set({heavyModules}))
+print(json.dumps({{"importTime": importTime, "heavy": heavy,
+    "peakMemoryMB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))
+"""
+
+def timeImport(module, heavyModules=HEAVY_MODULES):
+    script = IMPORT_SCRIPT.format(module=module, heavyModules=repr(heavyModules))
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True)
+    if (result.returncode != 0):
+        raise RuntimeError("Importing " + module + " failed:\n" + result.stderr)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def runBenchmark(modules=MODULES, numRuns=NUM_RUNS):
+    # {module: {"importTimeSec" (median of numRuns), "peakMemoryMB", "heavyModules", "limitSec", "ok"}}
+    results = {}
+    for module, limit in modules.items():
+        runs = [timeImport(module) for i in range(numRuns)]
+        importTime = float(np.median([run["importTime"] for run in runs]))
+        heavy = runs[-1]["heavy"]
+        ok = True
+        if (limit is not None):
+            ok = importTime <= limit and len(heavy) == 0
+        results[module] = {"importTimeSec": round(importTime, 3),
+                            "peakMemoryMB": round(max(run["peakMemoryMB"] for run in runs), 1),
+                            "heavyModules": heavy, "limitSec": limit, "ok": ok}
+        print(module, ": ", round(importTime * 1000), "ms, peak memory: ",
+                results[module]["peakMemoryMB"], "MB, heavy modules: ", heavy,
+                "" if ok else " <-- over the limit (" + str(limit) + " s) or loads heavy modules")
+    return results
+
+
+if __name__ == "__main__":
+    if (len(sys.argv) > 3):
+        print("Usage: python3 startupBenchmark.py [num_runs] [out_file.json]")
+        exit(0)
+    numRuns = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_RUNS
+    results = runBenchmark(MODULES, numRuns)
+    if (len(sys.argv) > 2):
+        with open(sys.argv[2], "w") as f:
+            json.dump(results, f, indent=2)
+    if (not all(result["ok"] for result in results.values())):
+        exit(1)
@@ -0,0 +1,26 @@
+import numpy as np
+import tensorflow as tf
+
+# tensorflow helpers of utility (imported on first use, see utility.LAZY_FUNCTIONS)
+
+# getTrainingWindows as a tf.data pipeline: only the (float32) base series is kept in memory,
+# the windows of each batch are gathered from it on the fly. Yields (X, y) batches.
+# numLabelCols: as in getTrainingWindows, y batches are then (batch, hours, columns)
+def getWindowDataset(data, trainWindowHours, labelWindowHours, batchSize, shuffle=False, seed=None,
+                        numLabelCols=None):
+    series = tf.constant(np.asarray(data, dtype=np.float32))
+    numWindows = max(len(data) - (trainWindowHours + labelWindowHours) + 1, 0)
+    inputOffsets = tf.range(trainWindowHours, dtype=tf.int64)
+    labelOffsets = tf.range(trainWindowHours, trainWindowHours + labelWindowHours, dtype=tf.int64)
+    labels = series[:, 0] if numLabelCols is None else series[:, :numLabelCols]
+
+    def getBatch(startIdx):
+        X = tf.gather(series, startIdx[:, tf.newaxis] + inputOffsets)
+        y = tf.gather(labels, startIdx[:, tf.newaxis] + labelOffsets)
+        return X, y
+
+    dataset = tf.data.Dataset.range(numWindows)
+    if (shuffle is True):
+        dataset = dataset.shuffle(max(numWindows, 1), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batchSize).map(getBatch, num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
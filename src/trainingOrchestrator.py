@@ -0,0 +1,123 @@
+import concurrent.futures
+import contextlib
+import csv
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+############################# MACRO START #######################################
+REGIONS = ["CISO", "PJM", "ERCO", "ISNE", "SE", "DE"]
+SOURCES = ["coal", "nat_gas", "oil", "solar", "wind", "hydro", "unknown", "geothermal",
+            "biomass", "nuclear"]
+DATA_DIR = "../data/"
+LOG_DIR = "../logs/"
+SUMMARY_FILE_NAME = "../data/training_summary.csv"
+THREADS_PER_WORKER = 2
+############################# MACRO END #########################################
+
+def getRegionSources(region):
+    # sources of a region that have a training file in <region>/fuel_forecast/
+    sources = []
+    for source in SOURCES:
+        inFileName = DATA_DIR+region+"/fuel_forecast/"+region+"_"+source+"_2019_clean.csv"
+        if (os.path.exists(inFileName)):
+            sources.append(source)
+    return sources
+
+def getJobs(regions, sources):
+    # regions, sources: lists, or "all"
+    if (regions == "all"):
+        regions = REGIONS
+    jobs = []
+    for region in regions:
+        regionSources = getRegionSources(region)
+        if (sources == "all"):
+            jobs.extend([(region, source) for source in regionSources])
+            continue
+        for source in sources:
+            if (source not in regionSources):
+                print("No training data for region: ", region, ", source: ", source, ", skipping.")
+                continue
+            jobs.append((region, source))
+    return jobs
+
+def initWorker(threadsPerWorker):
+    # pin TF thread pools before tensorflow is imported (& before any op runs)
+    os.environ["OMP_NUM_THREADS"] = str(threadsPerWorker)
+    os.environ["TF_NUM_INTRAOP_THREADS"] = str(threadsPerWorker)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threadsPerWorker)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    return
+
+def runJob(region, source):
+    # one runProgram-equivalent job, with its own log file
+    import sourceProductionForecast
+    os.makedirs(LOG_DIR, exist_ok=True)
+    logFileName = LOG_DIR + region + "_" + source + ".log"
+    periodRMSE, error = {}, None
+    startTime = time.time()
+    with open(logFileName, "w") as logFile, contextlib.redirect_stdout(logFile):
+        try:
+            periodRMSE = sourceProductionForecast.runProgram(region, source)
+        except Exception as e:
+            error = repr(e)
+            print("Failed: ", error)
+    return region, source, periodRMSE, time.time() - startTime, error
+
+def writeSummary(results, outFileName):
+    print("Writing summary to ", outFileName, "...")
+    fields = ["region", "source", "period", "rmse", "num_expts", "train_time_sec", "error"]
+    with open(outFileName, 'w') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        csvwriter.writerow(fields)
+        for region, source, periodRMSE, runTime, error in results:
+            if (error is not None):
+                csvwriter.writerow([region, source, "", "", 0, round(runTime, 1), error])
+            for period, rmse in periodRMSE.items():
+                csvwriter.writerow([region, source, period, np.mean(rmse), len(rmse),
+                                        round(runTime, 1), ""])
+    return
+
+def runOrchestrator(regions, sources, numWorkers=None, threadsPerWorker=THREADS_PER_WORKER,
+                        summaryFileName=SUMMARY_FILE_NAME):
+    jobs = getJobs(regions, sources)
+    if (numWorkers is None):
+        numWorkers = max(1, (os.cpu_count() or 1) // threadsPerWorker)
+    numWorkers = max(1, min(numWorkers, len(jobs)))
+    print("Jobs: ", len(jobs), ", workers: ", numWorkers, ", threads per worker: ", threadsPerWorker)
+
+    results = []
+    startTime = time.time()
+    # spawn: workers get a fresh interpreter (no forked TF state)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=numWorkers,
+                mp_context=multiprocessing.get_context("spawn"), initializer=initWorker,
+                initargs=(threadsPerWorker,)) as executor:
+        futures = [executor.submit(runJob, region, source) for region, source in jobs]
+        for future in concurrent.futures.as_completed(futures):
+            region, source, periodRMSE, runTime, error = future.result()
+            status = "failed: " + error if error is not None else str(periodRMSE)
+            print(region, source, "(", round(runTime, 1), "s): ", status)
+            results.append((region, source, periodRMSE, runTime, error))
+    print("All jobs done in ", round(time.time() - startTime, 1), " s")
+
+    results.sort(key=lambda result: (result[0], result[1]))
+    writeSummary(results, summaryFileName)
+    return results
+
+
+if __name__ == "__main__":
+    if (len(sys.argv) < 3 or len(sys.argv) > 5):
+        print("Usage: python3 trainingOrchestrator.py <regions> <sources> [num_workers] [threads_per_worker]")
+        print("regions, sources - comma separated lists, or all")
+        print("Example: python3 trainingOrchestrator.py CISO,PJM coal,nat_gas 4 2")
+        exit(0)
+    regions = "all" if sys.argv[1].lower() == "all" else sys.argv[1].split(",")
+    sources = "all" if sys.argv[2].lower() == "all" else sys.argv[2].split(",")
+    numWorkers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    threadsPerWorker = int(sys.argv[4]) if len(sys.argv) > 4 else THREADS_PER_WORKER
+    runOrchestrator(regions, sources, numWorkers, threadsPerWorker)
@@ -1,21 +1,39 @@
+import importlib
 import numpy as np
 import pandas as pd
 import pytz as pytz
-import tensorflow as tf
-import matplotlib.pyplot as plt
 import csv
 import math
-import seaborn as sns
-from statsmodels.tsa.stattools import adfuller
-import matplotlib.dates as mdates
+import os
+import pickle
 
+from numpy.lib.stride_tricks import sliding_window_view
+
+import forecastMetrics
+import instrumentation
+
+############################# MACRO START #######################################
+# Helpers that need tensorflow or the plotting/analysis packages. They live in separate
+# modules that are imported on first use (utility.getWindowDataset etc. still work), so
+# importing utility only loads numpy & pandas.
+LAZY_FUNCTIONS = {"getWindowDataset": "tfUtility",
+                  "showPlots": "plotUtility", "showTrends": "plotUtility",
+                  "createFeatureViolinGraph": "plotUtility", "analyzeTimeSeries": "plotUtility",
+                  "checkStationarity": "plotUtility"}
+############################# MACRO END #########################################
+
+def __getattr__(name):
+    if (name not in LAZY_FUNCTIONS):
+        raise AttributeError("module 'utility' has no attribute '" + name + "'")
+    function = getattr(importlib.import_module(LAZY_FUNCTIONS[name]), name)
+    globals()[name] = function
+    return function
 
 
 def inverseDataScaling(data, cmax, cmin):
     cdiff = cmax-cmin
     unscaledData = np.zeros_like(data)
-    for i in range(data.shape[0]):
-        unscaledData[i] = round(max(data[i]*cdiff + cmin, 0), 5)
+    unscaledData[...] = np.round(np.maximum(data*cdiff + cmin, 0), 5)
     return unscaledData
 
 def getDatesInLocalTimeZone(dateTime):
@@ -39,14 +57,9 @@ def getAvgContributionBySource(dataset):
     return contribution
 
 def getScores(scaledActual, scaledPredicted, unscaledActual, unscaledPredicted):
-    print("Actual data shape, Predicted data shape: ", scaledActual.shape, scaledPredicted.shape)
-    mse = tf.keras.losses.MeanSquaredError()
-    rmseScore = round(math.sqrt(mse(scaledActual, scaledPredicted)), 6)
-
-    mape = tf.keras.losses.MeanAbsolutePercentageError()
-    mapeTensor =  mape(unscaledActual, unscaledPredicted)
-    mapeScore = mapeTensor.numpy()
-
+    instrumentation.log("Actual data shape, Predicted data shape: ", scaledActual.shape, scaledPredicted.shape)
+    rmseScore = round(float(forecastMetrics.getRMSE(scaledActual, scaledPredicted)), 6)
+    mapeScore = forecastMetrics.getMAPE(unscaledActual, unscaledPredicted)
     return rmseScore, mapeScore
 
 def writeOutFuelForecastFile(outFileName, data, fuel):
@@ -62,95 +75,187 @@ def writeOutFuelForecastFile(outFileName, data, fuel):
         # writing the data rows 
         csvwriter.writerows(data)
 
-def showPlots():
-    plt.show()
+# On-disk cache of (key, object) pickles. readCache returns None on a miss or a stale key.
+def readCache(cacheFileName, key):
+    try:
+        with open(cacheFileName, "rb") as f:
+            cachedKey, obj = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    if (cachedKey != key):
+        return None
+    return obj
+
+def writeCache(cacheFileName, key, obj):
+    os.makedirs(os.path.dirname(cacheFileName), exist_ok=True)
+    tmpFileName = cacheFileName + ".tmp" + str(os.getpid())
+    with open(tmpFileName, "wb") as f:
+        pickle.dump((key, obj), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmpFileName, cacheFileName) # atomic, readers never see a partial file
+    return
+
+# Min-max scaling of each column to range (0, 1), fitted on training data.
+# Columns with a constant value are left unscaled. ftMin/ftMax (& the feature names)
+# can be saved next to a model, so inference does not need the training data.
+class FeatureScaler:
+    def __init__(self, ftMin=None, ftMax=None, featureList=None):
+        self.ftMin = None if ftMin is None else np.asarray(ftMin, dtype=np.float64)
+        self.ftMax = None if ftMax is None else np.asarray(ftMax, dtype=np.float64)
+        self.featureList = None if featureList is None else list(featureList)
+
+    def fit(self, trainData):
+        trainData = np.asarray(trainData, dtype=np.float64)
+        self.ftMin = np.nanmin(trainData, axis=0)
+        self.ftMax = np.nanmax(trainData, axis=0)
+        return self
+
+    def getRange(self):
+        ftRange = self.ftMax - self.ftMin
+        # constant columns: scale by 1 & don't shift, ie. leave them as they are
+        isConstant = (ftRange == 0)
+        return np.where(isConstant, 0, self.ftMin), np.where(isConstant, 1, ftRange)
+
+    def transform(self, data):
+        shift, ftRange = self.getRange()
+        return (np.asarray(data, dtype=np.float64) - shift) / ftRange
+
+    def inverseTransform(self, data, col=None):
+        # col: column of the features that data holds (eg. 0 for the forecast source),
+        # None if data has all columns
+        shift, ftRange = self.getRange()
+        if (col is not None):
+            shift, ftRange = shift[col], ftRange[col]
+        return np.asarray(data, dtype=np.float64) * ftRange + shift
+
+    def save(self, fileName):
+        featureList = [] if self.featureList is None else self.featureList
+        np.savez(fileName, ftMin=self.ftMin, ftMax=self.ftMax, 
+                    featureList=np.array(featureList, dtype=str))
+        return
+
+    @staticmethod
+    def load(fileName):
+        with np.load(fileName) as params:
+            featureList = params["featureList"].tolist()
+            return FeatureScaler(params["ftMin"], params["ftMax"], featureList or None)
 
 def scaleDataset(trainData, valData, testData):
     # Scaling columns to range (0, 1)
-    row, col = trainData.shape[0], trainData.shape[1]
-    ftMin, ftMax = [], []
-    for i in range(col):
-        fmax= trainData[0, i]
-        fmin = trainData[0, i]
-        for j in range(len(trainData[:, i])):
-            if(fmax < trainData[j, i]):
-                fmax = trainData[j, i]
-            if (fmin > trainData[j, i]):
-                fmin = trainData[j, i]
-        ftMin.append(fmin)
-        ftMax.append(fmax)
-        # print(fmax, fmin)
-
-    for i in range(col):
-        if((ftMax[i] - ftMin[i]) == 0):
-            continue
-        trainData[:, i] = (trainData[:, i] - ftMin[i]) / (ftMax[i] - ftMin[i])
-        valData[:, i] = (valData[:, i] - ftMin[i]) / (ftMax[i] - ftMin[i])
-        testData[:, i] = (testData[:, i] - ftMin[i]) / (ftMax[i] - ftMin[i])
-
-    return trainData, valData, testData, ftMin, ftMax
+    scaler = FeatureScaler().fit(trainData)
+    trainData = scaler.transform(trainData)
+    valData = scaler.transform(valData)
+    testData = scaler.transform(testData)
+    return trainData, valData, testData, scaler.ftMin, scaler.ftMax
 
 # Date time feature engineering
-def addDateTimeFeatures(dataset, dateTime, startCol):
-    dates = []
-    hourList = []
-    hourSin, hourCos = [], []
-    monthList = []
-    monthSin, monthCos = [], []
-    weekendList = []
-    columns = dataset.columns
+# Optional calendar features (appended after the existing columns, so column
+# positions used for slicing features are unchanged):
+#   localTimezone - adds local_hour_sin/local_hour_cos (eg. "US/Pacific")
+#   holidays - iterable of dates, adds a 0/1 "holiday" column (local dates if localTimezone is set)
+def addDateTimeFeatures(dataset, dateTime, startCol, localTimezone=None, holidays=None):
     secInDay = 24 * 60 * 60 # Seconds in day 
-    secInYear = year = (365.25) * secInDay # Seconds in year 
-
-    day = pd.to_datetime(dateTime[0])
-    isWeekend = 0
-    zero = 0
-    one = 0
-    for i in range(0, len(dateTime)):
-        day = pd.to_datetime(dateTime[i])
-        dates.append(day)
-        hourList.append(day.hour)
-        hourSin.append(np.sin(day.hour * (2 * np.pi / 24)))
-        hourCos.append(np.cos(day.hour * (2 * np.pi / 24)))
-        monthList.append(day.month)
-        monthSin.append(np.sin(day.timestamp() * (2 * np.pi / secInYear)))
-        monthCos.append(np.cos(day.timestamp() * (2 * np.pi / secInYear)))
-        if (day.weekday() < 5):
-            isWeekend = 0
-            zero +=1
-        else:
-            isWeekend = 1
-            one +=1
-        weekendList.append(isWeekend)        
+    secInYear = (365.25) * secInDay # Seconds in year 
+
+    dates = pd.DatetimeIndex(dateTime)
+    if (dates.tz is not None):
+        dates = dates.tz_convert("UTC").tz_localize(None)
+    hour = dates.hour.to_numpy()
+    timestamp = dates.values.astype("datetime64[ns]").astype(np.int64) / 1e9 # seconds (UTC)
+    weekendList = (dates.weekday.to_numpy() >= 5).astype(np.int64)
+    one = int(weekendList.sum())
+    zero = len(weekendList) - one
     loc = startCol+1
-    print(zero, one)
+    instrumentation.log(zero, one)
     # hour of day feature
-    dataset.insert(loc=loc, column="hour_sin", value=hourSin)
-    dataset.insert(loc=loc+1, column="hour_cos", value=hourCos)
+    dataset.insert(loc=loc, column="hour_sin", value=np.sin(hour * (2 * np.pi / 24)))
+    dataset.insert(loc=loc+1, column="hour_cos", value=np.cos(hour * (2 * np.pi / 24)))
     # month of year feature
-    dataset.insert(loc=loc+2, column="month_sin", value=monthSin)
-    dataset.insert(loc=loc+3, column="month_cos", value=monthCos)
+    dataset.insert(loc=loc+2, column="month_sin", value=np.sin(timestamp * (2 * np.pi / secInYear)))
+    dataset.insert(loc=loc+3, column="month_cos", value=np.cos(timestamp * (2 * np.pi / secInYear)))
     # is weekend feature
     dataset.insert(loc=loc+4, column="weekend", value=weekendList)
 
+    calendarDates = dates
+    if (localTimezone is not None):
+        calendarDates = dates.tz_localize("UTC").tz_convert(localTimezone)
+        localHour = calendarDates.hour.to_numpy()
+        dataset["local_hour_sin"] = np.sin(localHour * (2 * np.pi / 24))
+        dataset["local_hour_cos"] = np.cos(localHour * (2 * np.pi / 24))
+    if (holidays is not None):
+        holidayDates = pd.DatetimeIndex(pd.to_datetime(list(holidays))).normalize()
+        dataset["holiday"] = calendarDates.tz_localize(None).normalize().isin(holidayDates).astype(np.int64)
+
     # print(dataset.columns)
-    print(dataset.head())
+    instrumentation.log(dataset.head())
     return dataset
 
+# Windowing for model inputs/labels. These return strided views into data (no copies).
+# X[i] = data[i : i+trainWindowHours], y[i] = data[i+trainWindowHours : i+trainWindowHours+labelWindowHours, 0]
+# numLabelCols: labels of the first numLabelCols columns instead, y is then (windows, hours, columns)
+def getTrainingWindows(data, trainWindowHours, labelWindowHours, numLabelCols=None):
+    numWindows = len(data) - (trainWindowHours + labelWindowHours) + 1
+    labelShape = (labelWindowHours,) if numLabelCols is None else (labelWindowHours, numLabelCols)
+    if (numWindows <= 0):
+        return (np.empty((0, trainWindowHours) + data.shape[1:], dtype=data.dtype), 
+                np.empty((0,) + labelShape, dtype=data.dtype))
+    X = sliding_window_view(data[:numWindows+trainWindowHours-1], trainWindowHours, axis=0)
+    X = np.moveaxis(X, -1, 1) # (windows, hours, features)
+    if (numLabelCols is None):
+        y = sliding_window_view(data[trainWindowHours:, 0], labelWindowHours)[:numWindows]
+    else:
+        y = sliding_window_view(data[trainWindowHours:, :numLabelCols], labelWindowHours, axis=0)[:numWindows]
+        y = np.moveaxis(y, -1, 1) # (windows, hours, columns)
+    return X, y
+
+# X[i] = data[i*slidingWindowLen : i*slidingWindowLen+predictionWindowHours]
+def getTestWindows(data, slidingWindowLen, predictionWindowHours):
+    if (len(data) < predictionWindowHours):
+        return np.empty((0, predictionWindowHours) + data.shape[1:], dtype=data.dtype)
+    X = sliding_window_view(data, predictionWindowHours, axis=0)[::slidingWindowLen]
+    return np.moveaxis(X, -1, 1) # (windows, hours[, features])
+
+# Fills missing (NaN) cells column-wise.
+#   method - "ffill": previous hour's value, "interpolate": linear between neighbouring hours
+#   maxGap - gaps of more than maxGap consecutive hours are left as they are (None: no limit)
+# Gaps at the start of a column are filled from the first valid value.
+# Returns the filled (float) data & the no. of cells filled.
+def fillGaps(data, method="ffill", maxGap=None):
+    frame = pd.DataFrame(np.asarray(data, dtype=np.float64))
+    isMissing = frame.isna()
+    if (not isMissing.values.any()):
+        return frame.values, 0
+    if (method == "ffill"):
+        filled = frame.ffill()
+    elif (method == "interpolate"):
+        filled = frame.interpolate(method="linear", limit_direction="forward")
+    else:
+        raise ValueError("Unknown gap filling method: " + str(method))
+    filled = filled.bfill()
+    if (maxGap is not None):
+        # length of the gap each missing cell belongs to
+        gapId = (~isMissing).cumsum()
+        gapLen = pd.concat([isMissing[col].groupby(gapId[col]).transform("sum") 
+                                for col in frame.columns], axis=1)
+        filled = filled.mask(isMissing & (gapLen > maxGap))
+    numFilled = int(isMissing.values.sum() - filled.isna().values.sum())
+    return filled.values, numFilled
+
 def splitDataset(dataset, testDataSize, valDataSize): # testDataSize, valDataSize are in days
-    print("No. of rows in dataset:", len(dataset))
+    instrumentation.log("No. of rows in dataset:", len(dataset))
     valData = None
     numTestEntries = testDataSize * 24
     numValEntries = valDataSize * 24
     trainData, testData = dataset[:-numTestEntries], dataset[-numTestEntries:]
     fullTrainData = np.copy(trainData)
     trainData, valData = trainData[:-numValEntries], trainData[-numValEntries:]
-    print("No. of rows in training set:", len(trainData))
-    print("No. of rows in validation set:", len(valData))
-    print("No. of rows in test set:", len(testData))
+    instrumentation.log("No. of rows in training set:", len(trainData))
+    instrumentation.log("No. of rows in validation set:", len(valData))
+    instrumentation.log("No. of rows in test set:", len(testData))
     return trainData, valData, testData, fullTrainData
 
 def showModelSummary(history, model):
+    if (instrumentation.QUIET is True):
+        return
     print("Showing model summary...")
     model.summary()
     print("***** Model summary shown *****")
@@ -173,78 +278,5 @@ def showModelSummary(history, model):
     # # plt.title('Training loss (RMSE)')
     return
 
-def analyzeTimeSeries(dataset, trainData, unscaledCarbonIntensity, dateTime):
-    global NUM_FEATURES
-    global LOCAL_TIMEZONE
-    global START_COL
-    # checkStationarity(dataset)
-    # showTrends(dataset, dateTime, LOCAL_TIMEZONE)
-    print("Plotting each feature distribution...")
-    features = dataset.columns.values[START_COL:START_COL+NUM_FEATURES]
-    trainDataFrame = pd.DataFrame(unscaledCarbonIntensity, columns=features)
-    createFeatureViolinGraph(features, trainDataFrame, dateTime)
-    print("***** Feature distribution plotting done *****")
-    return
-
-def checkStationarity(dataset):
-    print(dataset.columns)
-    carbon = dataset["carbon_intensity"].values
-    print(len(carbon))
-    result = adfuller(carbon, autolag='AIC')
-    print(f'ADF Statistic: {result[0]}')
-    print(f'n_lags: {result[1]}')
-    print(f'p-value: {result[1]}')
-    for key, value in result[4].items():
-        print('Critial Values:')
-        print(f'   {key}, {value}')
-    return
-
-def showTrends(dataset, dateTime, localTimeZone):
-    global MONTH_INTERVAL
-    carbon = np.array(dataset["carbon_intensity"].values)
-    carbon = np.resize(carbon, (carbon.shape[0]//24, 24))
-    dailyAvgCarbon = np.mean(carbon, axis = 1)
-    dates = getDatesInLocalTimeZone(dateTime)    
-    
-    fig, ax = plt.subplots()
-    ax.plot(dates, dailyAvgCarbon)
-    # ax.xaxis.set_major_formatter(mdates.DateFormatter("%m-%d, %H:%M"))
-    ax.xaxis.set_major_formatter(mdates.DateFormatter("%m-%d"))
-    ax.xaxis.set_major_locator(mdates.MonthLocator(interval=MONTH_INTERVAL, tz=localTimeZone))
-    
-    plt.xlabel("Local time")
-    plt.ylabel("Carbon Intensity (g/kWh)")
-    # plt.title("Carbon Intensity Trend")
-    plt.grid(axis="x")
-    plt.xticks(rotation=90)
-
-    plt.legend()
-    # plt.show()
-    return
-
-def createFeatureViolinGraph(features, dataset, dateTime):
-    # print(features)
-    # print(dataset)
-    dataset = dataset.astype(np.float64)
-    plt.figure() #figsize=(12, 6)
-    datasetMod = dataset.melt(var_name='Column', value_name='Normalized values')
-    ax = sns.violinplot(x='Column', y='Normalized values', data=datasetMod, scale="count")
-    # ax = plt.boxplot(dataset, vert=True)
-    # for ft in features:
-    #     print(ft, np.amax(dataset[ft].values), np.amin(dataset[ft].values))
-    _ = ax.set_xticklabels(features, rotation=80)
-    plt.show()
-    return
-
 def getMape(dates, actual, forecast):
-    avgDailyMape = []
-    mape = tf.keras.losses.MeanAbsolutePercentageError()
-    for i in range(0, len(actual), 24):
-        mapeTensor =  mape(actual[i:i+24], forecast[i:i+24])
-        mapeScore = mapeTensor.numpy()
-        print("Day: ", dates[i], "MAPE: ", mapeScore)
-        avgDailyMape.append(mapeScore)
-
-    mapeTensor =  mape(actual, forecast)
-    mapeScore = mapeTensor.numpy()
-    return avgDailyMape, mapeScore
\ No newline at end of file
+    return forecastMetrics.getDailyMape(dates, actual, forecast)
\ No newline at end of file
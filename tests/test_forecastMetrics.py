@@ -0,0 +1,25 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import forecastMetrics
+
+def test_daily_errors_empty():
+    daily = forecastMetrics.getDailyErrors([], [])
+    for metric in forecastMetrics.METRICS:
+        assert len(daily[metric]) == 0
+
+def test_daily_mape_empty():
+    dailyMape, mape = forecastMetrics.getDailyMape([], [], [])
+    assert dailyMape == []
+    assert np.isnan(mape)
+
+def test_daily_errors_partial_day():
+    actual = np.full(30, 100.0)
+    forecast = np.concatenate([np.full(24, 90.0), np.full(6, 80.0)])
+    daily = forecastMetrics.getDailyErrors(actual, forecast)
+    assert np.allclose(daily["mape"], [10.0, 20.0])
+    assert np.allclose(daily["mae"], [10.0, 20.0])